@@ -0,0 +1,176 @@
+#! /usr/bin/python
+# -*- coding: utf-8 -*-
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
+
+#   Xbee to MQTT gateway
+#   Copyright (C) 2012 by Xose Pérez
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+__author__ = "Xose Pérez"
+__contact__ = "xose.perez@gmail.com"
+__copyright__ = "Copyright (C) Xose Pérez"
+__license__ = 'GPL v3'
+
+import time
+import logging
+import threading
+
+class Bucket(object):
+    """
+    Running statistics of the samples received during a time bucket
+    """
+
+    __slots__ = ['end', 'count', 'total', 'min', 'max', 'last']
+
+    def __init__(self, end, value):
+        self.end = end
+        self.count = 1
+        self.total = value
+        self.min = value
+        self.max = value
+        self.last = value
+
+    def add(self, value):
+        self.count += 1
+        self.total += value
+        self.last = value
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+
+    def summary(self, function):
+        if function == 'summary':
+            return dict((name, self.summary(name)) for name in ['last', 'mean', 'min', 'max', 'count'])
+        if function == 'mean':
+            return float(self.total) / self.count
+        return getattr(self, function)
+
+class Downsampler(object):
+    """
+    Aggregates numeric samples per address and port into time buckets
+    and reports their summary at the end of each bucket, either a dictionary
+    with every statistic or the single value of the configured function
+    """
+
+    functions = ['summary', 'last', 'mean', 'min', 'max', 'count']
+
+    # port prefixes of state changes, only downsampled if set for the route
+    events = ['dio-', 'pin-']
+
+    period = 0
+    function = 'summary'
+
+    logger = None
+
+    _settings = {}
+    _buckets = {}
+
+    def __init__(self):
+        """
+        Constructor, initializes the buckets
+        """
+        self._settings = {}
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def log(self, level, message):
+        if self.logger:
+            self.logger.log(level, message)
+
+    def configure(self, config):
+        """
+        Loads the default bucket period and summary function
+        and the per address and port overrides
+        """
+        config = config or {}
+        period, function = self.validate(config, 0, 'summary')
+        settings = {}
+        for address, ports in (config.get('routes', None) or {}).iteritems():
+            for port, override in ports.iteritems():
+                settings[(address, port)] = self.validate(override, period, function)
+
+        self.period, self.function = period, function
+        self._settings = settings
+
+    def validate(self, config, period, function):
+        """
+        Returns the period and function from a configuration block
+        """
+        period = int(config.get('period', period))
+        function = config.get('function', function)
+        if function not in self.functions:
+            self.log(logging.ERROR, "Unknown downsampling function '%s', using 'summary'" % function)
+            function = 'summary'
+        return period, function
+
+    def on_summary(self, address, port, value):
+        """
+        Hook for bucket summaries.
+        """
+        None
+
+    def add(self, address, port, value, now=None):
+        """
+        Adds a sample to the current bucket for the address and port,
+        returns False if the sample is not to be downsampled
+        """
+        key = (address, port)
+        settings = self._settings.get(key, None)
+        if settings is None:
+            if port[:4] in self.events:
+                return False
+            settings = (self.period, self.function)
+        period, function = settings
+        if period <= 0:
+            return False
+        try:
+            value = float(value) if isinstance(value, basestring) else value + 0
+        except (TypeError, ValueError):
+            return False
+
+        now = now or time.time()
+        expired = None
+        with self._lock:
+            bucket = self._buckets.get(key, None)
+            if bucket is not None and bucket.end <= now:
+                expired = bucket
+                bucket = None
+            if bucket is None:
+                # align buckets to the period so they match chart resolution
+                self._buckets[key] = Bucket((int(now) // period + 1) * period, value)
+            else:
+                bucket.add(value)
+
+        if expired:
+            self.on_summary(address, port, expired.summary(function))
+        return True
+
+    def flush(self, now=None, force=False):
+        """
+        Reports and removes the buckets whose period has ended,
+        or all of them if forced
+        """
+        now = now or time.time()
+        expired = []
+        with self._lock:
+            for key, bucket in self._buckets.items():
+                if force or bucket.end <= now:
+                    expired.append((key, bucket))
+                    del self._buckets[key]
+
+        for (address, port), bucket in expired:
+            period, function = self._settings.get((address, port), (self.period, self.function))
+            self.on_summary(address, port, bucket.summary(function))
@@ -0,0 +1,80 @@
+#! /usr/bin/python
+# -*- coding: utf-8 -*-
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
+
+#   Xbee to MQTT gateway
+#   Copyright (C) 2012 by Xose Pérez
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+__author__ = "Xose Pérez"
+__contact__ = "xose.perez@gmail.com"
+__copyright__ = "Copyright (C) Xose Pérez"
+__license__ = 'GPL v3'
+
+import time
+import threading
+from collections import OrderedDict
+
+class DuplicateStore(object):
+    """
+    Remembers the last value published to each topic during a time window.
+    Entries are kept in the order they were stored, which is also their
+    expiry order, so expiring and evicting only ever looks at the oldest ones.
+    """
+
+    window = 5
+    size = 10000
+
+    def __init__(self, window=None, size=None):
+        """
+        Constructor, optionally overrides the window in seconds and the maximum number of topics
+        """
+        if window is not None:
+            self.window = window
+        if size is not None:
+            self.size = size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def is_duplicate(self, topic, value, now=None):
+        """
+        Checks whether the value was already stored for the topic within the window,
+        if not it stores it
+        """
+        now = now or time.time()
+        with self._lock:
+            entry = self._entries.get(topic, None)
+            if entry is not None and entry[0] + self.window > now and entry[1] == value:
+                return True
+            if entry is not None:
+                del self._entries[topic]
+            self._entries[topic] = (now, value)
+            self.expire(now)
+        return False
+
+    def expire(self, now):
+        """
+        Drops the entries older than the window and the least recently stored
+        ones over the maximum size
+        """
+        entries = self._entries
+        while entries:
+            topic = next(iter(entries))
+            if entries[topic][0] + self.window > now and len(entries) <= self.size:
+                break
+            del entries[topic]
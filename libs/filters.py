@@ -24,30 +24,36 @@ __copyright__ = "Copyright (C) Xose Pérez"
 __license__ = 'GPL v3'
 
 import re
+import time
+from bisect import bisect_left
+from collections import deque
 from datetime import datetime
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 class FilterFactory(object):
     """
     Filter factory, returns the appropriate filter given the type
     """
 
-    filters = []
+    filters = {}
 
     @staticmethod
     def register(filter):
         """
         Registers a new filter class
         """
-        FilterFactory.filters.append(filter)
+        FilterFactory.filters[filter.name] = filter
 
     def __new__(self, type):
         """
         Constructor, returns an instance of a filter given type
         """
-        for filter in self.filters:
-            if filter.name == type:
-                return filter()
-        return None
+        filter = self.filters.get(type, None)
+        return filter() if filter else None
 
 class Filter(object):
     """
@@ -58,13 +64,16 @@ class Filter(object):
 
     parameters = None
 
+    # stateful filters keep data between calls
+    stateful = False
+
     required = []
 
     def configure(self, parameters):
         """
         Loads the configuration parameters
         """
-        self.parameters = parameters
+        self.parameters = parameters if parameters is not None else {}
 
     def validate(self):
         """
@@ -75,12 +84,25 @@ class Filter(object):
                 return False
         return True
 
+    def prepare(self):
+        """
+        Precomputes whatever the filter needs once the parameters are validated
+        """
+        pass
+
     def process(self, value):
         """
         Processes the value
         """
         return value
 
+    def process_batch(self, values):
+        """
+        Processes a list of values, returns a list with the results.
+        Filters override this to evaluate the whole list at once.
+        """
+        return [self.process(value) for value in values]
+
 class LinearFilter(Filter):
     """
     Simple linear filter: y=ax+b
@@ -89,6 +111,12 @@ class LinearFilter(Filter):
     required = ['slope', 'offset']
     def process(self, value):
         return self.parameters['slope'] * float(value) + self.parameters['offset']
+    def process_batch(self, values):
+        slope = self.parameters['slope']
+        offset = self.parameters['offset']
+        if numpy:
+            return (numpy.asarray(values, dtype=float) * slope + offset).tolist()
+        return [slope * float(value) + offset for value in values]
 FilterFactory.register(LinearFilter)
 
 class RoundFilter(Filter):
@@ -102,6 +130,13 @@ class RoundFilter(Filter):
         if self.parameters['decimals'] == 0:
             value = int(value)
         return value
+    def process_batch(self, values):
+        decimals = self.parameters['decimals']
+        # the builtin round, so batches round exactly as single values do
+        values = numpy.asarray(values, dtype=float).tolist() if numpy else [float(value) for value in values]
+        if decimals == 0:
+            return [int(round(value, 0)) for value in values]
+        return [round(value, decimals) for value in values]
 FilterFactory.register(RoundFilter)
 
 class BooleanFilter(Filter):
@@ -112,6 +147,10 @@ class BooleanFilter(Filter):
     required = []
     def process(self, value):
         return 0 if int(value) == 0 else 1
+    def process_batch(self, values):
+        if numpy:
+            return (numpy.asarray(values, dtype=int) != 0).astype(int).tolist()
+        return [0 if int(value) == 0 else 1 for value in values]
 FilterFactory.register(BooleanFilter)
 
 class NotFilter(Filter):
@@ -122,34 +161,81 @@ class NotFilter(Filter):
     required = []
     def process(self, value):
         return 1 if int(value) == 0 else 0
+    def process_batch(self, values):
+        if numpy:
+            return (numpy.asarray(values, dtype=int) == 0).astype(int).tolist()
+        return [1 if int(value) == 0 else 0 for value in values]
 FilterFactory.register(NotFilter)
 
 class EnumFilter(Filter):
     """
-    Enumeration filter, returns the value for a dictionary which key matches the input value
+    Enumeration filter, returns the value for a dictionary which key matches the input value,
+    values not in the dictionary return the value for the greatest key
     """
     name = 'enum'
     required = []
+    def prepare(self):
+        if not self.parameters:
+            raise ValueError("enumeration is empty")
+        self._index = dict((str(from_value), to_value) for from_value, to_value in self.parameters.iteritems())
+        self._default = self.parameters[max(self.parameters)]
     def process(self, value):
-        for from_value, to_value in self.parameters.iteritems():
-            if str(value) == str(from_value):
-                return to_value
-        return to_value
+        return self._index.get(str(value), self._default)
 FilterFactory.register(EnumFilter)
 
 class StepFilter(Filter):
     """
-    Step filter
+    Step filter, returns the value for the lowest threshold greater or equal than the input value,
+    values above every threshold return the value for the greatest one
     """
     name = 'step'
     required = []
+    def prepare(self):
+        if not self.parameters:
+            raise ValueError("step table is empty")
+        thresholds = sorted(self.parameters, key=float)
+        self._thresholds = [float(threshold) for threshold in thresholds]
+        self._values = [self.parameters[threshold] for threshold in thresholds]
+        self._last = len(thresholds) - 1
     def process(self, value):
-        for threshold, to_value in self.parameters.iteritems():
-            if float(value) <= threshold:
-                return to_value
-        return to_value
+        return self._values[min(bisect_left(self._thresholds, float(value)), self._last)]
+    def process_batch(self, values):
+        if numpy:
+            indexes = numpy.searchsorted(self._thresholds, numpy.asarray(values, dtype=float), side='left')
+            return [self._values[index] for index in numpy.minimum(indexes, self._last).tolist()]
+        return [self.process(value) for value in values]
 FilterFactory.register(StepFilter)
 
+class InterpolateFilter(Filter):
+    """
+    Piecewise linear interpolation over a calibration table of input: output points,
+    values outside the table are clamped to the first or last output
+    """
+    name = 'interpolate'
+    required = []
+    def prepare(self):
+        if len(self.parameters) < 2:
+            raise ValueError("calibration table needs at least two points")
+        points = sorted((float(x), float(y)) for x, y in self.parameters.iteritems())
+        self._x = [x for x, y in points]
+        self._y = [y for x, y in points]
+        self._last = len(points) - 1
+    def process(self, value):
+        value = float(value)
+        index = bisect_left(self._x, value)
+        if index == 0:
+            return self._y[0]
+        if index > self._last:
+            return self._y[self._last]
+        x0, x1 = self._x[index - 1], self._x[index]
+        y0, y1 = self._y[index - 1], self._y[index]
+        return y0 + (y1 - y0) * (value - x0) / (x1 - x0)
+    def process_batch(self, values):
+        if numpy:
+            return numpy.interp(numpy.asarray(values, dtype=float), self._x, self._y).tolist()
+        return [self.process(value) for value in values]
+FilterFactory.register(InterpolateFilter)
+
 class FormatFilter(Filter):
     """
     String format filter
@@ -173,8 +259,159 @@ class RegExpFilter(Filter):
     """
     name = 'regexp'
     required = ['pattern', 'replacement']
+    def prepare(self):
+        self._pattern = re.compile(self.parameters['pattern'])
     def process(self, value):
-        pattern = re.compile(self.parameters['pattern'])
-        return pattern.sub(self.parameters['replacement'], value)
+        return self._pattern.sub(self.parameters['replacement'], value)
 FilterFactory.register(RegExpFilter)
 
+
+class WindowFilter(Filter):
+    """
+    Abstract class for stateful filters working over a window of recent values,
+    the window holds up to 'samples' values and/or the values of the last 'period' seconds
+    """
+    required = []
+    stateful = True
+    default_samples = 0
+    def validate(self):
+        return self.default_samples > 0 or 'samples' in self.parameters or 'period' in self.parameters
+    def prepare(self):
+        samples = int(self.parameters.get('samples', self.default_samples))
+        self._period = float(self.parameters.get('period', 0))
+        if samples < 0 or self._period < 0:
+            raise ValueError("window size must be positive")
+        self._times = deque(maxlen=samples or None)
+        self._values = deque(maxlen=samples or None)
+    def push(self, value):
+        """
+        Stores a new value in the ring buffer, dropping the ones out of the window
+        """
+        now = time.time()
+        self._times.append(now)
+        self._values.append(float(value))
+        if self._period:
+            limit = now - self._period
+            while self._times[0] < limit:
+                self._times.popleft()
+                self._values.popleft()
+        return self._values
+
+class AverageFilter(WindowFilter):
+    """
+    Moving average over the window
+    """
+    name = 'average'
+    def process(self, value):
+        values = self.push(value)
+        return sum(values) / len(values)
+FilterFactory.register(AverageFilter)
+
+class MinimumFilter(WindowFilter):
+    """
+    Minimum value in the window
+    """
+    name = 'min'
+    def process(self, value):
+        return min(self.push(value))
+FilterFactory.register(MinimumFilter)
+
+class MaximumFilter(WindowFilter):
+    """
+    Maximum value in the window
+    """
+    name = 'max'
+    def process(self, value):
+        return max(self.push(value))
+FilterFactory.register(MaximumFilter)
+
+class MedianFilter(WindowFilter):
+    """
+    Median of the values in the window
+    """
+    name = 'median'
+    def process(self, value):
+        values = sorted(self.push(value))
+        middle = len(values) // 2
+        if len(values) % 2:
+            return values[middle]
+        return (values[middle - 1] + values[middle]) / 2
+FilterFactory.register(MedianFilter)
+
+class DerivativeFilter(WindowFilter):
+    """
+    Rate of change per second between the oldest and the newest value in the window,
+    defaults to the last two samples
+    """
+    name = 'derivative'
+    default_samples = 2
+    def process(self, value):
+        values = self.push(value)
+        elapsed = self._times[-1] - self._times[0]
+        if elapsed <= 0:
+            return 0.0
+        return (values[-1] - values[0]) / elapsed
+FilterFactory.register(DerivativeFilter)
+
+class EWMAFilter(Filter):
+    """
+    Exponentially weighted moving average: y=alpha*x+(1-alpha)*y'
+    """
+    name = 'ewma'
+    required = ['alpha']
+    stateful = True
+    def prepare(self):
+        self._alpha = float(self.parameters['alpha'])
+        if not 0 < self._alpha <= 1:
+            raise ValueError("alpha must be in the (0, 1] range")
+        self._average = None
+    def process(self, value):
+        value = float(value)
+        if self._average is None:
+            self._average = value
+        else:
+            self._average += self._alpha * (value - self._average)
+        return self._average
+FilterFactory.register(EWMAFilter)
+
+class DeadbandFilter(Filter):
+    """
+    Report by exception filter, returns None (the value is not published) unless it moves
+    more than 'absolute' units or 'percent' % away from the last reported value
+    or more than 'heartbeat' seconds have passed since then.
+    It should be the last filter in a chain.
+    """
+    name = 'deadband'
+    required = []
+    stateful = True
+    def validate(self):
+        return 'absolute' in self.parameters or 'percent' in self.parameters
+    def prepare(self):
+        self._absolute = float(self.parameters.get('absolute', 0))
+        self._percent = float(self.parameters.get('percent', 0))
+        self._heartbeat = float(self.parameters.get('heartbeat', 0))
+        self._last_value = None
+        self._last_time = 0
+    def process(self, value):
+        now = time.time()
+        if self._last_value is not None \
+            and not (self._heartbeat and now - self._last_time >= self._heartbeat) \
+            and self.inside(value):
+                return None
+        self._last_value = value
+        self._last_time = now
+        return value
+    def inside(self, value):
+        """
+        Checks whether the value lies within the band around the last reported one
+        """
+        try:
+            delta = abs(float(value) - float(self._last_value))
+        except (TypeError, ValueError):
+            return value == self._last_value
+        if self._absolute and delta > self._absolute:
+            return False
+        if self._percent and delta > abs(float(self._last_value)) * self._percent / 100:
+            return False
+        return True
+FilterFactory.register(DeadbandFilter)
@@ -0,0 +1,152 @@
+#! /usr/bin/python
+# -*- coding: utf-8 -*-
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
+
+#   Xbee to MQTT gateway
+#   Copyright (C) 2012 by Xose Pérez
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+__author__ = "Xose Pérez"
+__contact__ = "xose.perez@gmail.com"
+__copyright__ = "Copyright (C) Xose Pérez"
+__license__ = 'GPL v3'
+
+from itertools import islice
+
+START = '\x7e'
+ESCAPE = '\x7d'
+
+class FrameDecoder(object):
+    """
+    XBee API frame decoder, for API mode 1 or API mode 2 (escaped).
+    It takes the bytes read from the serial port in chunks of any size
+    and returns the data of the complete frames with a valid checksum.
+    Garbage and broken frames are skipped up to the next start delimiter.
+    """
+
+    # longer frames are taken as a corrupted length
+    max_length = 1024
+
+    def __init__(self, escaped=False):
+        """
+        Constructor, escaped for API mode 2
+        """
+        self.escaped = escaped
+        self.errors = 0
+        self._buffer = bytearray()
+
+    def __len__(self):
+        return len(self._buffer)
+
+    def feed(self, data):
+        """
+        Adds the data read and returns a list with the data of every complete frame,
+        the API identifier followed by the frame specific data
+        """
+        self._buffer.extend(data)
+        if self.escaped:
+            return self.decode_escaped()
+        return self.decode()
+
+    def valid(self, data, start, end):
+        """
+        Checks the checksum of the frame data and checksum byte between start and end,
+        all the bytes must add up to 0xFF
+        """
+        return sum(islice(data, start, end)) & 0xFF == 0xFF
+
+    def decode(self):
+        """
+        API mode 1, the start delimiter can appear inside a frame
+        so the frames are found by their length and checksum
+        """
+        buffer = self._buffer
+        frames = []
+        position = 0
+        size = len(buffer)
+        while True:
+            start = buffer.find(START, position)
+            if start < 0:
+                position = size
+                break
+            if size - start < 3:
+                position = start
+                break
+            length = buffer[start + 1] << 8 | buffer[start + 2]
+            if length == 0 or length > self.max_length:
+                self.errors += 1
+                position = start + 1
+                continue
+            end = start + 4 + length
+            if size < end:
+                position = start
+                break
+            if self.valid(buffer, start + 3, end):
+                frames.append(str(buffer[start + 3:end - 1]))
+                position = end
+            else:
+                self.errors += 1
+                position = start + 1
+        del buffer[:position]
+        return frames
+
+    def decode_escaped(self):
+        """
+        API mode 2, start delimiters only appear at the start of a frame
+        so the buffer is split by them and every part unescaped
+        """
+        buffer = self._buffer
+        frames = []
+        position = buffer.find(START)
+        if position < 0:
+            del buffer[:]
+            return frames
+        while True:
+            following = buffer.find(START, position + 1)
+            end = following if following >= 0 else len(buffer)
+            frame = self.unescape(buffer, position + 1, end)
+            length = frame[0] << 8 | frame[1] if len(frame) >= 2 else None
+            if length is not None and (length == 0 or length > self.max_length):
+                self.errors += 1
+            elif length is not None and len(frame) >= length + 3:
+                if self.valid(frame, 2, length + 3):
+                    frames.append(str(frame[2:length + 2]))
+                else:
+                    self.errors += 1
+            elif following < 0:
+                # the rest of the frame is still to be read
+                break
+            else:
+                # cut short by the next frame
+                self.errors += 1
+            if following < 0:
+                position = len(buffer)
+                break
+            position = following
+        del buffer[:position]
+        return frames
+
+    def unescape(self, data, start, end):
+        """
+        Returns the bytes between start and end unescaped,
+        an escape character at the end is left out until the next byte arrives
+        """
+        parts = str(data[start:end]).split(ESCAPE)
+        frame = bytearray(parts[0])
+        for part in parts[1:]:
+            if part:
+                frame.append(ord(part[0]) ^ 0x20)
+                frame.extend(part[1:])
+        return frame
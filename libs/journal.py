@@ -0,0 +1,297 @@
+#! /usr/bin/python
+# -*- coding: utf-8 -*-
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
+
+#   Xbee to MQTT gateway
+#   Copyright (C) 2012 by Xose Pérez
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+__author__ = "Xose Pérez"
+__contact__ = "xose.perez@gmail.com"
+__copyright__ = "Copyright (C) Xose Pérez"
+__license__ = 'GPL v3'
+
+import os
+import json
+import glob
+import mmap
+import time
+import zlib
+import struct
+import logging
+import threading
+
+class Segment(object):
+    """
+    Journal segment, a fixed size memory mapped file records are appended to.
+    The header keeps the offset of the next record to replay.
+    Every record carries a checksum, so a torn write at the tail is detected
+    and ignored when the segment is opened again.
+    Segments written before records had properties are still replayed.
+    """
+
+    header = struct.Struct('<4sII')
+    record = struct.Struct('<IIdBBHH')
+    legacy_record = struct.Struct('<IIdBBH')
+
+    magic = 'XBJ2'
+    legacy_magic = 'XBJ1'
+
+    def __init__(self, path, size):
+        """
+        Constructor, creates or opens the segment file and looks for the end of the valid records
+        """
+        self.path = path
+        exists = os.path.exists(path)
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0644)
+        try:
+            if not exists or os.fstat(fd).st_size < size:
+                os.ftruncate(fd, size)
+            self.size = os.fstat(fd).st_size
+            self.map = mmap.mmap(fd, self.size)
+        finally:
+            os.close(fd)
+
+        magic, read, checksum = self.header.unpack_from(self.map, 0)
+        if magic == self.legacy_magic and checksum == self.checksum(magic, read):
+            self.magic = magic
+            self.record = self.legacy_record
+        elif magic != self.magic or checksum != self.checksum(magic, read):
+            read = self.header.size
+            self.set_read(read)
+        self.read = read
+        self.write = self.scan(self.header.size)
+        if self.read > self.write:
+            self.set_read(self.write)
+
+    @staticmethod
+    def checksum(*values):
+        return zlib.crc32(''.join(str(value) for value in values)) & 0xffffffff
+
+    def set_read(self, offset):
+        """
+        Stores the offset of the next record to replay
+        """
+        self.read = offset
+        self.header.pack_into(self.map, 0, self.magic, offset, self.checksum(self.magic, offset))
+
+    def scan(self, offset):
+        """
+        Returns the offset after the last valid record
+        """
+        record = self.parse(offset)
+        while record is not None:
+            offset = record[0]
+            record = self.parse(offset)
+        return offset
+
+    def parse(self, offset):
+        """
+        Returns the offset of the next record and the record fields
+        or None if there is no valid record at the given offset
+        """
+        if offset + self.record.size > self.size:
+            return None
+        fields = self.record.unpack_from(self.map, offset)
+        checksum, length, timestamp, qos, retain, topic_length = fields[:6]
+        properties_length = fields[6] if len(fields) > 6 else 0
+        end = offset + self.record.size + length
+        if length == 0 or topic_length + properties_length > length or end > self.size:
+            return None
+        if zlib.crc32(self.map[offset + 4:end]) & 0xffffffff != checksum:
+            return None
+        start = offset + self.record.size
+        topic = self.map[start:start + topic_length]
+        start += topic_length
+        properties = self.map[start:start + properties_length]
+        payload = self.map[start + properties_length:end]
+        return end, timestamp, topic, payload, qos, retain, properties
+
+    def append(self, timestamp, topic, payload, qos, retain, properties=''):
+        """
+        Appends a record, returns False if it does not fit
+        or if the segment has the format without properties
+        """
+        length = len(topic) + len(properties) + len(payload)
+        end = self.write + self.record.size + length
+        if end > self.size or self.record is self.legacy_record:
+            return False
+        start = self.write + self.record.size
+        self.map[start:start + len(topic)] = topic
+        start += len(topic)
+        self.map[start:start + len(properties)] = properties
+        self.map[start + len(properties):end] = payload
+        self.record.pack_into(self.map, self.write, 0, length, timestamp, qos, retain, len(topic), len(properties))
+        checksum = zlib.crc32(self.map[self.write + 4:end]) & 0xffffffff
+        struct.pack_into('<I', self.map, self.write, checksum)
+        self.write = end
+        return True
+
+    def peek(self):
+        """
+        Returns the next record to replay or None
+        """
+        if self.read >= self.write:
+            return None
+        return self.parse(self.read)
+
+    def pending(self):
+        return self.read < self.write
+
+    def close(self):
+        self.map.flush()
+        self.map.close()
+
+class Journal(object):
+    """
+    Disk backed store and forward journal for outgoing messages.
+    Messages are appended to a directory of memory mapped segments
+    and replayed in order, the oldest segments are discarded when the
+    journal exceeds 'max_size' bytes and records older than 'max_age'
+    seconds are skipped on replay.
+    """
+
+    segment_size = 1024 * 1024
+    max_size = 64 * 1024 * 1024
+    max_age = 0
+
+    # messages per second replayed after a reconnection
+    rate = 50
+
+    # seconds between flushes of the current segment to disk
+    sync_interval = 5
+
+    logger = None
+
+    def __init__(self, path):
+        """
+        Constructor, path is the folder holding the segments
+        """
+        self.path = path
+        self.dropped = 0
+        self._segments = []
+        self._lock = threading.Lock()
+        self._synced = time.time()
+
+    def log(self, level, message):
+        if self.logger:
+            self.logger.log(level, message)
+
+    def open(self):
+        """
+        Opens the existing segments
+        """
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+        for path in sorted(glob.glob(os.path.join(self.path, '*.journal'))):
+            segment = Segment(path, self.segment_size)
+            if segment.pending():
+                self._segments.append(segment)
+            else:
+                segment.close()
+                os.remove(path)
+        if self._segments:
+            self.log(logging.INFO, "Journal has %d segments pending replay" % len(self._segments))
+
+    def close(self):
+        with self._lock:
+            for segment in self._segments:
+                segment.close()
+            self._segments = []
+
+    def __nonzero__(self):
+        return any(segment.pending() for segment in self._segments)
+
+    def append(self, topic, payload, qos=0, retain=False, timestamp=None, properties=None):
+        """
+        Appends a message to the journal, properties is an optional dictionary
+        """
+        if isinstance(topic, unicode):
+            topic = topic.encode('utf-8')
+        if isinstance(payload, unicode):
+            payload = payload.encode('utf-8')
+        properties = json.dumps(properties, sort_keys=True) if properties else ''
+        timestamp = timestamp or time.time()
+        with self._lock:
+            segment = self._segments[-1] if self._segments else None
+            if segment is None or not segment.append(timestamp, topic, payload, qos, retain, properties):
+                segment = self.rotate()
+                if not segment.append(timestamp, topic, payload, qos, retain, properties):
+                    self.log(logging.WARNING, "Message for %s too big for the journal" % topic)
+                    self.dropped += 1
+            if timestamp - self._synced >= self.sync_interval:
+                segment.map.flush()
+                self._synced = timestamp
+
+    def rotate(self):
+        """
+        Opens a new segment, discarding the oldest ones over the size limit
+        """
+        name = '%020d.journal' % int(time.time() * 1000000)
+        segment = Segment(os.path.join(self.path, name), self.segment_size)
+        self._segments.append(segment)
+        while len(self._segments) * self.segment_size > self.max_size and len(self._segments) > 1:
+            self.discard(self._segments[0], "Journal full")
+        return segment
+
+    def discard(self, segment, reason):
+        """
+        Removes a segment, counting the records it had pending
+        """
+        count = 0
+        offset = segment.read
+        while offset < segment.write:
+            offset = segment.parse(offset)[0]
+            count += 1
+        if count:
+            self.dropped += count
+            self.log(logging.WARNING, "%s, %d messages dropped" % (reason, count))
+        segment.close()
+        os.remove(segment.path)
+        self._segments.remove(segment)
+
+    def peek(self):
+        """
+        Returns the next message to replay as (topic, payload, qos, retain, timestamp, properties)
+        or None if there is none. Messages older than max_age are dropped.
+        """
+        with self._lock:
+            while self._segments:
+                segment = self._segments[0]
+                record = segment.peek()
+                if record is None:
+                    if len(self._segments) == 1:
+                        return None
+                    self.discard(segment, "Journal segment replayed")
+                    continue
+                end, timestamp, topic, payload, qos, retain, properties = record
+                if self.max_age and timestamp + self.max_age < time.time():
+                    segment.set_read(end)
+                    self.dropped += 1
+                    continue
+                properties = json.loads(properties) if properties else None
+                return topic, payload, qos, retain, timestamp, properties
+        return None
+
+    def pop(self):
+        """
+        Marks the next message as replayed
+        """
+        with self._lock:
+            if self._segments:
+                segment = self._segments[0]
+                record = segment.peek()
+                if record is not None:
+                    segment.set_read(record[0])
@@ -0,0 +1,147 @@
+#! /usr/bin/python
+# -*- coding: utf-8 -*-
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
+
+#   Xbee to MQTT gateway
+#   Copyright (C) 2012 by Xose Pérez
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+__author__ = "Xose Pérez"
+__contact__ = "xose.perez@gmail.com"
+__copyright__ = "Copyright (C) Xose Pérez"
+__license__ = 'GPL v3'
+
+import time
+from collections import OrderedDict
+
+class LineBuffer(object):
+    """
+    Partial line received from a node,
+    overflow is set while dropping the rest of a line too long to keep
+    """
+
+    __slots__ = ['data', 'updated', 'overflow']
+
+    def __init__(self, now):
+        self.data = bytearray()
+        self.updated = now
+        self.overflow = False
+
+class LineAssembler(object):
+    """
+    Reassembles the lines sent through the UART of the remote radios,
+    that might arrive split in several packets.
+    Only the new bytes are scanned for line ends. Lines longer than
+    'max_length' are dropped up to their end, partial lines older than
+    'timeout' seconds are dropped or flushed as a line if 'flush' is set,
+    and only the 'max_nodes' most recently heard nodes are remembered.
+    """
+
+    max_length = 1024
+    timeout = 30
+    flush = False
+    max_nodes = 1000
+
+    def __init__(self):
+        """
+        Constructor, buffers are kept in the order they were last updated
+        """
+        self.dropped = 0
+        self._buffers = OrderedDict()
+        self._expired = []
+
+    def __len__(self):
+        return len(self._buffers)
+
+    def feed(self, address, data, now=None):
+        """
+        Adds the data received from a node, returns the complete lines
+        """
+        now = now or time.time()
+        lines = []
+        buffer = self._buffers.pop(address, None)
+        if buffer is not None and buffer.updated + self.timeout <= now:
+            lines += [line for _, line in self.stale(address, buffer)]
+            buffer = None
+
+        start = 0
+        end = data.find('\n')
+        while end >= 0:
+            if buffer is not None and buffer.overflow:
+                # end of a line too long to keep
+                buffer.overflow = False
+            elif buffer is not None and buffer.data:
+                buffer.data.extend(data[start:end])
+                lines.append(str(buffer.data))
+                del buffer.data[:]
+            else:
+                lines.append(data[start:end])
+            start = end + 1
+            end = data.find('\n', start)
+
+        if start < len(data):
+            if buffer is None:
+                buffer = LineBuffer(now)
+            if not buffer.overflow:
+                if len(buffer.data) + len(data) - start > self.max_length:
+                    # a line never ends, drop it up to the next line end
+                    self.dropped += 1
+                    del buffer.data[:]
+                    buffer.overflow = True
+                else:
+                    buffer.data.extend(data[start:])
+            buffer.updated = now
+            self.keep(address, buffer)
+        elif buffer is not None and (buffer.data or buffer.overflow):
+            self.keep(address, buffer)
+
+        return lines
+
+    def keep(self, address, buffer):
+        """
+        Stores the buffer of a node, evicting the least recently heard nodes
+        """
+        self._buffers[address] = buffer
+        while len(self._buffers) > self.max_nodes:
+            self._expired += self.stale(*self._buffers.popitem(last=False))
+
+    def stale(self, address, buffer):
+        """
+        Flushes or drops a partial line that timed out or was evicted,
+        returns the flushed lines as a list of address and line
+        """
+        if buffer.overflow:
+            return []
+        if self.flush:
+            return [(address, str(buffer.data))] if buffer.data else []
+        if buffer.data:
+            self.dropped += 1
+        return []
+
+    def expire(self, now=None):
+        """
+        Removes the partial lines that timed out,
+        returns the flushed ones as well as the ones from evicted nodes
+        as a list of address and line
+        """
+        now = now or time.time()
+        expired, self._expired = self._expired, []
+        while self._buffers:
+            address, buffer = next(self._buffers.iteritems())
+            if buffer.updated + self.timeout > now:
+                break
+            del self._buffers[address]
+            expired += self.stale(address, buffer)
+        return expired
@@ -23,9 +23,18 @@ __copyright__ = "Copyright (C) 2013 Xose Pérez"
 __license__ = 'GPL v3'
 
 from paho.mqtt.client import Client as Mosquitto
+from paho.mqtt.client import MQTT_ERR_SUCCESS
+from paho.mqtt.client import MQTT_ERR_NO_CONN
+from paho.mqtt.client import MQTTv5
+from paho.mqtt.properties import Properties
+from paho.mqtt.packettypes import PacketTypes
+from collections import OrderedDict
 import ctypes
+import json
 import time
+import random
 import logging
+import threading
 
 # Class messages
 MSG_CONNECTED = 1
@@ -47,6 +56,9 @@ class MosquittoWrapper(Mosquitto):
     set_will = True
 
     status_topic = '/service/%s/status'
+
+    # connection metrics document published on every connection, None to disable
+    metrics_topic = '/service/%s/connection'
     subscribe_to = []
 
     connected = False
@@ -54,8 +66,52 @@ class MosquittoWrapper(Mosquitto):
 
     on_message_cleaned = None
 
+    # maximum number of topics sent in a single (un)subscription request
+    subscription_batch_size = 100
+
+    # reconnection backoff limits in seconds
+    reconnect_min_delay = 1
+    reconnect_max_delay = 300
+
+    # MQTT v5 only: maximum number of topic aliases, 0 to use the broker's maximum
+    topic_alias_maximum = 0
+
+    # MQTT v5 only: send the source address and timestamp as user properties
+    user_properties = True
+
+    # connection metrics
+    connect_attempts = 0
+    connections = 0
+    disconnections = 0
+    connected_since = None
+    disconnected_since = None
+
     _subscriptions = {}
 
+    def __init__(self, *args, **kwargs):
+        """
+        Constructor, initializes the subscription state
+        """
+        Mosquitto.__init__(self, *args, **kwargs)
+        self._subscriptions = {}
+        self._desired = set()
+        self._subscribed = set()
+        self._subscriptions_dirty = False
+        self._subscriptions_lock = threading.RLock()
+        self._backoff = 0
+        self._next_attempt = None
+        self._aliases = OrderedDict()
+        self._alias_maximum = 0
+        self._publish_lock = threading.Lock()
+
+    def reinitialise(self, client_id=""):
+        """
+        Resets the client with a new client id keeping the protocol version
+        """
+        protocol = self._protocol
+        self._reset_sockets()
+        self.__init__(client_id, protocol=protocol)
+
     def log(self, level, message):
         if self.logger:
             self.logger.log(level, message)
@@ -74,61 +130,234 @@ class MosquittoWrapper(Mosquitto):
             self.username_pw_set(self.username, self.password)
         if self.set_will:
             self.will_set(self.status_topic % self._client_id, "0", self.qos, self.retain)
+        self.subscribe(self.subscribe_to)
+        self.attempt()
+
+    def attempt(self):
+        """
+        Tries to connect to the broker, scheduling a new attempt if it fails
+        """
+        self._next_attempt = None
+        self.connect_attempts += 1
         self.log(logging.INFO, "Connecting to MQTT broker")
-        Mosquitto.connect(self, self.host, self.port, self.keepalive)
+        try:
+            Mosquitto.connect(self, self.host, self.port, self.keepalive)
+        except Exception as e:
+            self.log(logging.ERROR, "Could not connect to MQTT broker (%s)" % e)
+            self.schedule()
+
+    def schedule(self):
+        """
+        Schedules a connection attempt with jittered exponential backoff,
+        so a broker restart is not hammered by every client at the same time
+        """
+        self._backoff = min(max(self._backoff * 2, self.reconnect_min_delay), self.reconnect_max_delay)
+        delay = random.uniform(self._backoff / 2.0, self._backoff)
+        self._next_attempt = time.time() + delay
+        self.log(logging.INFO, "Reconnecting to MQTT broker in %.1f seconds" % delay)
+
+    def restart(self):
+        """
+        Drops the current connection and connects again with the current parameters
+        """
+        Mosquitto.disconnect(self)
+        self.connect()
+
+    def loop(self, timeout=1.0, max_packets=1):
+        """
+        Sends pending subscription changes and processes network events.
+        While disconnected it never blocks for longer than timeout,
+        and tries to reconnect when the next attempt is due.
+        """
+        if self._next_attempt is not None:
+            remaining = self._next_attempt - time.time()
+            if remaining > 0:
+                time.sleep(min(remaining, timeout))
+                return MQTT_ERR_NO_CONN
+            self.attempt()
+            if self._next_attempt is not None:
+                return MQTT_ERR_NO_CONN
+        self.sync_subscriptions()
+        rc = Mosquitto.loop(self, timeout, max_packets)
+        if rc == MQTT_ERR_NO_CONN and self._next_attempt is None:
+            # explicitly disconnected, do not spin
+            time.sleep(timeout)
+        return rc
+
+    def metrics(self):
+        """
+        Returns the connection metrics, timestamps in seconds since the epoch
+        """
+        return {
+            'attempts': self.connect_attempts,
+            'connections': self.connections,
+            'disconnections': self.disconnections,
+            'connected_since': self.connected_since,
+            'disconnected_since': self.disconnected_since,
+        }
 
     def subscribe(self, topics):
         """
-        Subscribe to a given topic
+        Adds the given topics to the desired subscriptions,
+        the changes are sent batched from the loop
         """
         if not isinstance(topics, list):
             topics = [topics]
-        for topic in topics:
-            rc, mid = Mosquitto.subscribe(self, topic, 0)
-            self._subscriptions[mid] = topic
-            self.log(logging.INFO, "Sent subscription request to topic %s" % topic)
+        with self._subscriptions_lock:
+            for topic in topics:
+                if topic not in self._desired:
+                    self._desired.add(topic)
+                    self._subscriptions_dirty = True
 
     def unsubscribe(self, topics):
         """
-        Unsubscribe of a given topic
+        Removes the given topics from the desired subscriptions,
+        the changes are sent batched from the loop
         """
         if not isinstance(topics, list):
             topics = [topics]
-        for topic in topics:
-            rc, mid = Mosquitto.unsubscribe(self, topic)
-            self._subscriptions[mid] = topic
-            self.log(logging.INFO, "Sent unsubscription request of topic %s" % topic)
+        with self._subscriptions_lock:
+            for topic in topics:
+                if topic in self._desired:
+                    self._desired.remove(topic)
+                    self._subscriptions_dirty = True
+
+    def sync_subscriptions(self):
+        """
+        Diffs the desired subscriptions against the current ones
+        and sends the changes batched in multi-topic requests
+        """
+        with self._subscriptions_lock:
+            if not self._subscriptions_dirty or not self.connected:
+                return
+            added = sorted(self._desired - self._subscribed)
+            removed = sorted(self._subscribed - self._desired)
+            self._subscriptions_dirty = False
+
+            size = self.subscription_batch_size
+            for index in range(0, len(added), size):
+                topics = added[index:index + size]
+                rc, mid = self.send_subscribe(topics)
+                if rc != MQTT_ERR_SUCCESS:
+                    self._subscriptions_dirty = True
+                    break
+                self._subscribed.update(topics)
+                self._subscriptions[mid] = topics
+                self.log(logging.INFO, "Sent subscription request to topics %s" % ', '.join(topics))
+
+            for index in range(0, len(removed), size):
+                topics = removed[index:index + size]
+                rc, mid = self.send_unsubscribe(topics)
+                if rc != MQTT_ERR_SUCCESS:
+                    self._subscriptions_dirty = True
+                    break
+                self._subscribed.difference_update(topics)
+                self._subscriptions[mid] = topics
+                self.log(logging.INFO, "Sent unsubscription request of topics %s" % ', '.join(topics))
+
+    def send_subscribe(self, topics):
+        """
+        Sends a single subscription request for the given topics
+        """
+        return Mosquitto.subscribe(self, [(topic, 0) for topic in topics])
+
+    def send_unsubscribe(self, topics):
+        """
+        Sends a single unsubscription request for the given topics
+        """
+        return Mosquitto.unsubscribe(self, topics)
 
-    def publish(self, topic, value, qos=None, retain=None):
+    def publish(self, topic, value, qos=None, retain=None, properties=None):
         """
-        Publishes a value to a given topic, uses pre-loaded values for QoS and retain
+        Publishes a value to a given topic, uses pre-loaded values for QoS and retain.
+        With MQTT v5 the properties dictionary is sent as user properties
+        and QoS 0 messages use topic aliases.
         """
         qos = qos if qos is not None else self.qos
         retain = retain if retain is not None else self.retain
-        Mosquitto.publish(self, topic, str(value), qos, retain)
+        if self._protocol != MQTTv5:
+            return Mosquitto.publish(self, topic, str(value), qos, retain)
+
+        packet = Properties(PacketTypes.PUBLISH)
+        if properties and self.user_properties:
+            packet.UserProperty = [(str(k), str(v)) for k, v in sorted(properties.iteritems())]
+        # aliases must reach the broker in the same order they are assigned
+        with self._publish_lock:
+            if qos == 0:
+                # messages with QoS > 0 might be resent on a new connection
+                # where the alias means nothing, so they always go with the topic
+                topic, alias = self.alias(topic)
+                if alias:
+                    packet.TopicAlias = alias
+            return Mosquitto.publish(self, topic, str(value), qos, retain, packet)
 
-    def __on_connect(self, mosq, obj, flags, rc):
+    def alias(self, topic):
+        """
+        Returns the topic and topic alias to publish with.
+        Aliases are kept for the most recently used topics, once the table is full
+        the alias of the least recently used topic is reassigned.
+        A topic is only sent in full the first time it gets an alias.
+        """
+        if not self._alias_maximum:
+            return topic, None
+        alias = self._aliases.pop(topic, None)
+        if alias is not None:
+            self._aliases[topic] = alias
+            return '', alias
+        if len(self._aliases) < self._alias_maximum:
+            alias = len(self._aliases) + 1
+        else:
+            alias = self._aliases.popitem(last=False)[1]
+        self._aliases[topic] = alias
+        return topic, alias
+
+    def __on_connect(self, mosq, obj, flags, rc, properties=None):
         """
         Callback when connection to the MQTT broker has succedeed or failed
         """
         if rc == 0:
-            self.log(logging.INFO , "Connected to MQTT broker")
-            self.publish(self.status_topic % self._client_id, "1")
-            self.subscribe(self.subscribe_to)
+            # aliases only live as long as the connection
+            maximum = getattr(properties, 'TopicAliasMaximum', 0)
+            if self.topic_alias_maximum:
+                maximum = min(maximum, self.topic_alias_maximum)
+            with self._publish_lock:
+                self._aliases = OrderedDict()
+                self._alias_maximum = maximum
             self.connected = True
+            self.connections += 1
+            self.connected_since = time.time()
+            metrics = self.metrics()
+            self.log(logging.INFO , "Connected to MQTT broker after %d attempts (%d connections, %d disconnections)" % \
+                (self.connect_attempts, self.connections, self.disconnections))
+            self.publish(self.status_topic % self._client_id, "1")
+            if self.metrics_topic:
+                self.publish(self.metrics_topic % self._client_id, json.dumps(metrics, sort_keys=True))
+            self.connect_attempts = 0
+            self._backoff = 0
+            # subscribe again to everything on every new connection
+            with self._subscriptions_lock:
+                self._subscribed = set()
+                self._subscriptions_dirty = True
+            self.sync_subscriptions()
         else:
             self.log(logging.ERROR , "Could not connect to MQTT broker")
             self.connected = False
 
-    def __on_disconnect(self, mosq, obj, rc):
+    def __on_disconnect(self, mosq, obj, rc, properties=None):
         """
         Callback when disconnecting from the MQTT broker
         """
+        with self._publish_lock:
+            self._alias_maximum = 0
+        if self.connected:
+            self.disconnections += 1
+            self.disconnected_since = time.time()
         self.connected = False
+        self._subscriptions = {}
         self.log(logging.INFO, "Disconnected from MQTT broker")
-        if rc != 0:
-            time.sleep(3)
-            self.connect()
+        # MQTT v5 reason codes only implement equality
+        if not rc == 0:
+            self.schedule()
 
     def __on_message(self, mosq, obj, msg):
         """
@@ -141,19 +370,19 @@ class MosquittoWrapper(Mosquitto):
                 message = msg.payload
             self.on_message_cleaned(msg.topic, message)
 
-    def __on_subscribe(self, mosq, obj, mid, qos_list):
+    def __on_subscribe(self, mosq, obj, mid, qos_list, properties=None):
         """
         Callback when succeeded subscription
         """
-        topic = self._subscriptions.get(mid, 'Unknown')
-        self.log(logging.INFO, "Subscription to topic %s confirmed" % topic)
+        topics = self._subscriptions.pop(mid, ['Unknown'])
+        self.log(logging.INFO, "Subscription to topics %s confirmed" % ', '.join(topics))
 
-    def __on_unsubscribe(self, mosq, obj, mid):
+    def __on_unsubscribe(self, mosq, obj, mid, *args):
         """
         Callback when succeeded an unsubscription
         """
-        topic = self._subscriptions.get(mid, 'Unknown')
-        self.log(logging.INFO, "Unsubscription of topic %s confirmed" % topic)
+        topics = self._subscriptions.pop(mid, ['Unknown'])
+        self.log(logging.INFO, "Unsubscription of topics %s confirmed" % ', '.join(topics))
 
     def __on_log(self, mosq, obj, level, string):
         self.log(logging.DEBUG, string)
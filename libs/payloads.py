@@ -0,0 +1,195 @@
+#! /usr/bin/python
+# -*- coding: utf-8 -*-
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
+
+#   Xbee to MQTT gateway
+#   Copyright (C) 2012 by Xose Pérez
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+__author__ = "Xose Pérez"
+__contact__ = "xose.perez@gmail.com"
+__copyright__ = "Copyright (C) Xose Pérez"
+__license__ = 'GPL v3'
+
+import json
+import logging
+from topics import TopicTrie
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import cbor2
+except ImportError:
+    cbor2 = None
+
+def text(value):
+    """
+    Decodes the byte strings in a value,
+    binary codecs would send them as binary data otherwise
+    """
+    if isinstance(value, str):
+        return value.decode('utf-8', 'replace')
+    if isinstance(value, dict):
+        return dict((text(key), text(item)) for key, item in value.iteritems())
+    if isinstance(value, (list, tuple)):
+        return [text(item) for item in value]
+    return value
+
+class CodecFactory(object):
+    """
+    Codec factory, returns the appropriate payload codec given the name
+    """
+
+    codecs = {}
+
+    @staticmethod
+    def register(codec):
+        """
+        Registers a new codec class
+        """
+        CodecFactory.codecs[codec.name] = codec
+
+    def __new__(self, name):
+        """
+        Constructor, returns an instance of a codec given its name
+        or None if it does not exist or its module is not installed
+        """
+        codec = self.codecs.get(name, None)
+        return codec() if codec and codec.available() else None
+
+class Codec(object):
+    """
+    Abstract class for a payload codec
+    """
+
+    name = ''
+
+    @staticmethod
+    def available():
+        """
+        Checks whether the modules the codec depends on are installed
+        """
+        return True
+
+    def encode(self, value):
+        """
+        Encodes the value into a payload
+        """
+        return str(value)
+
+class TextCodec(Codec):
+    """
+    Plain text, documents are sent as JSON
+    """
+    name = 'text'
+
+    def encode(self, value):
+        if isinstance(value, (dict, list)):
+            return json.dumps(value, sort_keys=True)
+        return str(value)
+
+CodecFactory.register(TextCodec)
+
+class JSONCodec(Codec):
+    """
+    JSON, numbers keep their type
+    """
+    name = 'json'
+
+    def encode(self, value):
+        return json.dumps(value, sort_keys=True, separators=(',', ':'))
+
+CodecFactory.register(JSONCodec)
+
+class MessagePackCodec(Codec):
+    """
+    MessagePack, requires the msgpack module
+    """
+    name = 'msgpack'
+
+    @staticmethod
+    def available():
+        return msgpack is not None
+
+    def encode(self, value):
+        return msgpack.packb(text(value), use_bin_type=True)
+
+CodecFactory.register(MessagePackCodec)
+
+class CBORCodec(Codec):
+    """
+    CBOR, requires the cbor2 module
+    """
+    name = 'cbor'
+
+    @staticmethod
+    def available():
+        return cbor2 is not None
+
+    def encode(self, value):
+        return cbor2.dumps(text(value))
+
+CodecFactory.register(CBORCodec)
+
+class PayloadEncoder(object):
+    """
+    Encodes values into message payloads with the codec configured for their topic,
+    topics (wildcards allowed) without a codec use the default one
+    """
+
+    logger = None
+
+    def __init__(self):
+        """
+        Constructor, everything is sent as text by default
+        """
+        self.codec = TextCodec()
+        self._codecs = TopicTrie()
+
+    def log(self, level, message):
+        if self.logger:
+            self.logger.log(level, message)
+
+    def configure(self, config):
+        """
+        Loads the default codec and the per topic codecs
+        """
+        config = config or {}
+        codec = self.create(config.get('codec', 'text')) or TextCodec()
+        codecs = TopicTrie()
+        for topic, name in (config.get('topics', None) or {}).iteritems():
+            topic_codec = self.create(name)
+            if topic_codec:
+                codecs.add(topic, topic_codec)
+        self.codec, self._codecs = codec, codecs
+
+    def create(self, name):
+        """
+        Returns a codec instance, logs an error if there is none with that name
+        """
+        codec = CodecFactory(name)
+        if codec is None:
+            self.log(logging.ERROR, "Unknown or unavailable payload codec '%s'" % name)
+        return codec
+
+    def encode(self, topic, value):
+        """
+        Encodes the value with the codec for the topic
+        """
+        codec = self._codecs.match(topic, self.codec) if len(self._codecs) else self.codec
+        return codec.encode(value)
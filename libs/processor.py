@@ -23,40 +23,199 @@ __contact__ = "xose.perez@gmail.com"
 __copyright__ = "Copyright (C) Xose Pérez"
 __license__ = 'GPL v3'
 
+import logging
 from filters import FilterFactory
+from topics import TopicTrie
 
 class Processor(object):
     """
     Processes values using the appropriate filter strategy
     """
 
+    logger = None
+
+    # topics matching no filter remembered at most
+    cache_size = 1024
+
     _filters = {}
+    _chains = {}
+    _sources = {}
+    _misses = set()
+    _patterns = TopicTrie()
 
-    def __init__(self, filters):
+    errors = []
+
+    def __init__(self, filters=None):
         """
         Constructor, loads the strategy mappings
         """
+        if filters is not None:
+            self.load(filters)
+
+    def log(self, level, message):
+        if self.logger:
+            self.logger.log(level, message)
+
+    def load(self, filters):
+        """
+        Compiles the filter chain for every topic once,
+        so processing a value does not have to build nor validate anything.
+        Invalid filter definitions are reported and left out of the chain.
+        Topics can be MQTT topic filters with + and # wildcards,
+        their chains are built the first time a matching topic is processed.
+        Topics whose configuration has not changed keep their current chain,
+        and with it the state of any stateful filter.
+        """
+        filters = filters or {}
+        patterns = TopicTrie()
+        chains = {}
+        sources = {}
+        errors = []
+        for topic, config in filters.iteritems():
+            chain, chain_errors = self.compile(config)
+            errors.extend(["%s: %s" % (topic, error) for error in chain_errors])
+            if TopicTrie.is_wildcard(topic):
+                try:
+                    patterns.add(topic, topic)
+                except ValueError as e:
+                    errors.append("%s: %s" % (topic, e))
+            else:
+                chains[topic] = chain
+                sources[topic] = topic
+
+        for error in errors:
+            self.log(logging.ERROR, "Invalid filter for topic %s" % error)
+
+        changed = [topic for topic in set(filters) | set(self._filters) \
+            if filters.get(topic, None) != self._filters.get(topic, None)]
+        self.log(logging.INFO, "Loaded %d filter definitions, %d changed" % (len(filters), len(changed)))
+
+        # keep the chains whose configuration did not change
+        for topic, chain in self._chains.iteritems():
+            source = sources.get(topic, None) or patterns.match(topic)
+            if source is not None \
+                and source == self._sources.get(topic, None) \
+                and filters[source] == self._filters.get(source, None) \
+                :
+                    chains[topic] = chain
+                    sources[topic] = source
+
+        # swap the lookup tables in one go
         self._filters = filters
+        self._patterns = patterns
+        self._sources = sources
+        self._chains = chains
+        self._misses = set()
+        self.errors = errors
+        return not errors
+
+    def resolve(self, topic):
+        """
+        Builds and caches the chain for a topic matching a wildcard topic filter,
+        every topic gets its own filter instances so they do not share state.
+        Topics matching no filter are only remembered up to 'cache_size'.
+        """
+        if topic in self._misses:
+            return []
+        source = self._patterns.match(topic)
+        if source is None:
+            if len(self._misses) >= self.cache_size:
+                self._misses = set()
+            self._misses.add(topic)
+            return []
+        config = self._filters.get(source, None)
+        chain = self.compile(config)[0] if config is not None else []
+        self._sources[topic] = source
+        self._chains[topic] = chain
+        return chain
+
+    def compile(self, config):
+        """
+        Builds a list of configured filter instances from a topic configuration,
+        returns the chain and a list of error messages
+        """
+        if not isinstance(config, list):
+            config = [config]
+
+        chain = []
+        errors = []
+        for element in config:
+            if not isinstance(element, dict):
+                errors.append("filter definition must be a dictionary")
+                continue
+            type = element.get('type', None)
+            filter = FilterFactory(type)
+            if filter is None:
+                errors.append("unknown filter type '%s'" % type)
+                continue
+            filter.configure(element.get('parameters', None))
+            if not filter.validate():
+                errors.append("missing parameters for filter '%s', required: %s" % (type, ', '.join(filter.required)))
+                continue
+            try:
+                filter.prepare()
+            except Exception as e:
+                errors.append("could not prepare filter '%s' (%s)" % (type, e))
+                continue
+            chain.append(filter)
+
+        return chain, errors
 
     def process(self, topic, value):
         """
-        Gets the filter strategy for the given topic,
-        instantiates a filter for that strategy using the FilterFactory and
-        requests the filter to process the input value
+        Gets the precompiled filter chain for the given topic and
+        requests every filter in it to process the input value.
+        Returns None if a filter decided the value should not be published.
         """
+        chain = self._chains.get(topic, None)
+        if chain is None:
+            chain = self.resolve(topic)
+        if not chain:
+            return value
 
+        original = value
         try:
-            config = self._filters[topic]
-            if not isinstance(config, list):
-                config = [config]
-            for element in config:
-                filter = FilterFactory(element.get('type', None))
-                if (filter):
-                    filter.configure(element.get('parameters', None))
-                    if filter.validate():
-                        value = filter.process(value)
-
-        except:
-            pass
+            for filter in chain:
+                value = filter.process(value)
+                if value is None:
+                    break
+        except Exception as e:
+            self.log(logging.WARNING, "Error processing value %r for topic %s (%s)" % (original, topic, e))
+            return original
 
         return value
+
+    def process_batch(self, topic, values, stateless=False):
+        """
+        Processes a list of values for the given topic at once,
+        every filter in the chain evaluates the whole list before the next one.
+        Returns a list with the processed values, None for the values a filter
+        decided should not be published, which skip the rest of the chain.
+        With stateless the stateful filters are skipped, for values that are
+        not consecutive samples and must not change the filter state.
+        """
+        values = list(values)
+        chain = self._chains.get(topic, None)
+        if chain is None:
+            chain = self.resolve(topic)
+        if stateless:
+            chain = [filter for filter in chain if not filter.stateful]
+        if not chain:
+            return values
+
+        original = values
+        values = list(values)
+        indexes = range(len(values))
+        try:
+            for filter in chain:
+                processed = filter.process_batch([values[index] for index in indexes])
+                for index, value in zip(indexes, processed):
+                    values[index] = value
+                indexes = [index for index in indexes if values[index] is not None]
+                if not indexes:
+                    break
+        except Exception as e:
+            self.log(logging.WARNING, "Error processing %d values for topic %s (%s)" % (len(original), topic, e))
+            return original
+
+        return values
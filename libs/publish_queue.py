@@ -0,0 +1,282 @@
+#! /usr/bin/python
+# -*- coding: utf-8 -*-
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
+
+#   Xbee to MQTT gateway
+#   Copyright (C) 2012 by Xose Pérez
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+__author__ = "Xose Pérez"
+__contact__ = "xose.perez@gmail.com"
+__copyright__ = "Copyright (C) Xose Pérez"
+__license__ = 'GPL v3'
+
+import time
+import logging
+import threading
+from itertools import count
+from collections import OrderedDict, deque
+from topics import TopicTrie
+
+class PublishQueue(object):
+    """
+    Bounded queue of outgoing messages drained to the MQTT broker by a background thread.
+    While queued, telemetry topics only keep their latest value, events are never coalesced.
+    When the queue reaches its high water mark the oldest message is dropped.
+    The drain thread stops pulling messages while disconnected or while the broker
+    has not yet taken the last 'inflight' messages, so memory use stays flat.
+    """
+
+    size = 1000
+    inflight = 100
+
+    # seconds between overflow reports
+    report_interval = 60
+
+    # seconds to wait before publishing again a message that failed
+    retry_interval = 1
+
+    logger = None
+
+    # optional disk journal to store messages while disconnected
+    journal = None
+
+    def __init__(self, mqtt, size=None):
+        """
+        Constructor, mqtt is the client used to publish
+        """
+        self.mqtt = mqtt
+        if size is not None:
+            self.size = size
+        self.events = TopicTrie()
+        self.queued = 0
+        self.coalesced = 0
+        self.dropped = 0
+        self.published = 0
+        self.failed = 0
+        self._messages = OrderedDict()
+        self._sequence = count()
+        self._condition = threading.Condition()
+        self._thread = None
+        self._running = False
+        self._reported = 0
+        self._report_time = 0
+
+    def __len__(self):
+        return len(self._messages)
+
+    def log(self, level, message):
+        if self.logger:
+            self.logger.log(level, message)
+
+    def configure(self, events):
+        """
+        Loads the list of topics (wildcards allowed) that are never coalesced
+        """
+        trie = TopicTrie()
+        for topic in events or []:
+            trie.add(topic, True)
+        self.events = trie
+
+    def put(self, topic, value, coalesce=True, properties=None):
+        """
+        Queues a message, replacing the queued value for the topic if it can be coalesced.
+        Properties are passed along to the broker client.
+        """
+        coalesce = coalesce and not self.events.match(topic, False)
+        with self._condition:
+            self.queued += 1
+            if coalesce and topic in self._messages:
+                # keeps its place in the queue
+                self._messages[topic] = (topic, value, properties)
+                self.coalesced += 1
+                return
+            if len(self._messages) >= self.size:
+                self._messages.popitem(last=False)
+                self.dropped += 1
+            key = topic if coalesce else (topic, next(self._sequence))
+            self._messages[key] = (topic, value, properties)
+            self._condition.notify()
+
+    def get(self, timeout=None):
+        """
+        Returns the oldest message or None if there is none after timeout seconds
+        """
+        with self._condition:
+            if not self._messages and self._running:
+                self._condition.wait(timeout)
+            if not self._messages:
+                return None
+            return self._messages.popitem(last=False)[1]
+
+    def start(self):
+        """
+        Starts the drain thread
+        """
+        if self.journal is not None:
+            self.journal.open()
+        self._running = True
+        self._thread = threading.Thread(target=self.drain, name='publish-queue')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self, timeout=5):
+        """
+        Stops the drain thread, giving it some time to flush the queue
+        """
+        limit = time.time() + timeout
+        while self._messages and self.mqtt.connected and time.time() < limit:
+            time.sleep(.1)
+        with self._condition:
+            self._running = False
+            self._condition.notify()
+        if self._thread:
+            self._thread.join(timeout)
+        if self.journal is not None:
+            self.spool()
+            self.journal.close()
+
+    def drain(self):
+        """
+        Drain thread, publishes the queued messages.
+        Messages in the journal are replayed at the journal rate
+        in between the live ones, which are published right away.
+        """
+        inflight = deque()
+        replay = 0
+        retry = None
+        # topics published live while the journal had messages
+        live = set()
+        while self._running:
+            self.report()
+            connected = self.mqtt.connected
+            if self.journal is not None and retry is not None:
+                self.store(retry)
+                retry = None
+            if not connected:
+                inflight.clear()
+                if self.journal is not None:
+                    self.spool()
+                    self.wait(.1)
+                else:
+                    time.sleep(.1)
+                continue
+            pending = self.journal is not None and bool(self.journal)
+            timeout = .5
+            if pending:
+                now = time.time()
+                if now >= replay:
+                    if self.replay(live):
+                        replay = now + 1.0 / self.journal.rate
+                    else:
+                        # keep it in the journal and try again later
+                        replay = now + self.retry_interval
+                timeout = max(min(replay - time.time(), timeout), 0)
+            elif live:
+                live = set()
+            while inflight and self.is_published(inflight[0]):
+                inflight.popleft()
+            if len(inflight) >= self.inflight:
+                inflight[0].wait_for_publish(min(timeout, .1))
+                continue
+            message = retry if retry is not None else self.get(timeout)
+            retry = None
+            if message is None:
+                continue
+            topic, value, properties = message
+            try:
+                info = self.mqtt.publish(topic, value, properties=properties)
+            except Exception as e:
+                self.log(logging.ERROR, "Error publishing to %s (%s)" % (topic, e))
+                self.failed += 1
+                continue
+            if info is None or info.rc != 0:
+                # the client did not take it, publish it again before any other
+                self.failed += 1
+                retry = message
+                time.sleep(self.retry_interval)
+                continue
+            self.published += 1
+            inflight.append(info)
+            if pending:
+                live.add(topic)
+
+    def replay(self, live):
+        """
+        Publishes the next message in the journal, returns False if the client did not take it.
+        Topics already published live are replayed without retain,
+        so an older value does not replace the retained one.
+        """
+        message = self.journal.peek()
+        if message is None:
+            return True
+        topic, payload, qos, retain, timestamp, properties = message
+        try:
+            info = self.mqtt.publish(topic, payload, qos, retain and topic not in live, properties=properties)
+        except Exception as e:
+            self.log(logging.ERROR, "Error replaying message to %s (%s)" % (topic, e))
+            return False
+        if info is None or info.rc != 0:
+            return False
+        self.journal.pop()
+        self.published += 1
+        return True
+
+    def wait(self, timeout):
+        """
+        Waits for new messages to be queued
+        """
+        with self._condition:
+            if not self._messages and self._running:
+                self._condition.wait(timeout)
+
+    def spool(self):
+        """
+        Moves the queued messages to the journal
+        """
+        while True:
+            message = self.get(0)
+            if message is None:
+                break
+            self.store(message)
+
+    def store(self, message):
+        """
+        Appends a message to the journal
+        """
+        topic, value, properties = message
+        self.journal.append(topic, str(value), self.mqtt.qos, self.mqtt.retain, properties=properties)
+
+    def is_published(self, info):
+        """
+        Checks whether the broker client is done with a message
+        """
+        try:
+            return info.is_published()
+        except (ValueError, RuntimeError):
+            return True
+
+    def report(self):
+        """
+        Logs the queue counters if messages were dropped since the last report
+        """
+        now = time.time()
+        if self.dropped > self._reported and now - self._report_time >= self.report_interval:
+            self.log(logging.WARNING,
+                "Publish queue overflow: %d messages dropped, %d coalesced, %d queued, %d published" % \
+                (self.dropped, self.coalesced, self.queued, self.published)
+            )
+            self._reported = self.dropped
+            self._report_time = now
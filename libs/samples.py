@@ -0,0 +1,131 @@
+#! /usr/bin/python
+# -*- coding: utf-8 -*-
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
+
+#   Xbee to MQTT gateway
+#   Copyright (C) 2012 by Xose Pérez
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+__author__ = "Xose Pérez"
+__contact__ = "xose.perez@gmail.com"
+__copyright__ = "Copyright (C) Xose Pérez"
+__license__ = 'GPL v3'
+
+import struct
+import binascii
+
+IO_SAMPLE = '\x92'
+
+class ChannelTable(object):
+    """
+    Layout of the samples for a pair of digital and analog channel masks:
+    port names, struct format and the bit of every digital channel
+    """
+
+    __slots__ = ['ports', 'bits', 'format', 'size']
+
+    def __init__(self, digital_mask, analog_mask):
+        digital = [i for i in range(13) if digital_mask & (1 << i)]
+        analog = [i for i in range(8) if analog_mask & (1 << i)]
+        self.ports = tuple(['dio-%d' % i for i in digital] + ['adc-%d' % i for i in analog])
+        self.bits = tuple(digital)
+        self.format = struct.Struct('>' + ('H' if digital else '') + 'H' * len(analog))
+        self.size = self.format.size
+
+    def unpack(self, data, offset):
+        """
+        Returns the values of a sample, in the same order as the ports
+        """
+        values = self.format.unpack_from(data, offset)
+        if not self.bits:
+            return values
+        digital = values[0]
+        return tuple([(digital >> bit) & 1 for bit in self.bits]) + values[1:]
+
+class IOSample(object):
+    """
+    Values of an IO sample, it can be read like a dictionary of port values.
+    The ports tuple is shared by all the samples with the same channel masks.
+    """
+
+    __slots__ = ['ports', 'values']
+
+    def __init__(self, ports, values):
+        self.ports = ports
+        self.values = values
+
+    def __len__(self):
+        return len(self.ports)
+
+    def __iter__(self):
+        return iter(self.ports)
+
+    def __getitem__(self, port):
+        try:
+            return self.values[self.ports.index(port)]
+        except ValueError:
+            raise KeyError(port)
+
+    def keys(self):
+        return list(self.ports)
+
+    def iteritems(self):
+        return iter(zip(self.ports, self.values))
+
+    def items(self):
+        return zip(self.ports, self.values)
+
+    def __repr__(self):
+        return repr(dict(zip(self.ports, self.values)))
+
+class SampleDecoder(object):
+    """
+    Decodes ZigBee IO Data Sample Rx Indicator (0x92) frames straight from the frame data,
+    with a channel table computed once per channel masks
+    """
+
+    # header: 64 bit address, 16 bit address, options, sample count, digital and analog masks
+    header = struct.Struct('>8s2sBBHB')
+
+    def __init__(self):
+        self._tables = {}
+
+    def table(self, digital_mask, analog_mask):
+        """
+        Returns the channel table for the masks
+        """
+        key = (digital_mask, analog_mask)
+        table = self._tables.get(key, None)
+        if table is None:
+            table = self._tables[key] = ChannelTable(digital_mask, analog_mask)
+        return table
+
+    def decode(self, data):
+        """
+        Decodes the frame data (API identifier included), returns the hex address of
+        the source and the list of samples, or None if it is not a valid IO sample frame
+        """
+        if data[:1] != IO_SAMPLE or len(data) < self.header.size + 1:
+            return None
+        address, _, _, count, digital_mask, analog_mask = self.header.unpack_from(data, 1)
+        table = self.table(digital_mask & 0x1CFF, analog_mask)
+        offset = self.header.size + 1
+        if len(data) < offset + table.size * count:
+            return None
+        samples = []
+        for i in range(count):
+            samples.append(IOSample(table.ports, table.unpack(data, offset)))
+            offset += table.size
+        return binascii.hexlify(address), samples
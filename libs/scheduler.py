@@ -0,0 +1,331 @@
+#! /usr/bin/python
+# -*- coding: utf-8 -*-
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
+
+#   Xbee to MQTT gateway
+#   Copyright (C) 2012 by Xose Pérez
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+__author__ = "Xose Pérez"
+__contact__ = "xose.perez@gmail.com"
+__copyright__ = "Copyright (C) Xose Pérez"
+__license__ = 'GPL v3'
+
+import time
+import logging
+import threading
+from collections import deque
+
+# AT command response status names
+STATUS = {
+    '\x00': 'OK',
+    '\x01': 'ERROR',
+    '\x02': 'Invalid Command',
+    '\x03': 'Invalid Parameter',
+    '\x04': 'Tx Failure',
+}
+
+class Command(object):
+    """
+    AT command request, local if it has no address.
+    It works as a future that resolves with the response status and parameter,
+    or with a None status if there was no response.
+    """
+
+    __slots__ = [
+        'address', 'command', 'parameter', 'timeout', 'retries',
+        'frame_id', 'attempts', 'deadline', 'created', 'finished',
+        'status', 'response', '_callbacks', '_event', '_lock'
+    ]
+
+    def __init__(self, address, command, parameter=None, timeout=None, retries=None):
+        self.address = address
+        self.command = command
+        self.parameter = parameter
+        self.timeout = timeout
+        self.retries = retries
+        self.frame_id = None
+        self.attempts = 0
+        self.deadline = None
+        self.created = time.time()
+        self.finished = None
+        self.status = None
+        self.response = None
+        self._callbacks = []
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+
+    @property
+    def ok(self):
+        return self.status == '\x00'
+
+    @property
+    def status_name(self):
+        if self.status is None:
+            return 'Timeout' if self.done() else None
+        return STATUS.get(self.status, 'Unknown')
+
+    @property
+    def latency(self):
+        """
+        Seconds from the request to its response, retries included
+        """
+        return self.finished - self.created if self.finished else None
+
+    def done(self):
+        return self._event.is_set()
+
+    def wait(self, timeout=None):
+        """
+        Waits for the response, returns whether there is one
+        """
+        self._event.wait(timeout)
+        return self.done()
+
+    def result(self, timeout=None):
+        """
+        Waits for the response and returns its status name and parameter
+        """
+        self.wait(timeout)
+        return self.status_name, self.response
+
+    def add_done_callback(self, callback):
+        """
+        Calls back with the request once resolved, right away if it already is
+        """
+        with self._lock:
+            if not self.done():
+                self._callbacks.append(callback)
+                return
+        callback(self)
+
+    def resolve(self, status, response):
+        """
+        Stores the response and runs the callbacks
+        """
+        with self._lock:
+            self.status = status
+            self.response = response
+            self.finished = time.time()
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback(self)
+
+def wait(requests, timeout=None):
+    """
+    Waits for many requests in parallel, returns the ones resolved
+    """
+    deadline = time.time() + timeout if timeout is not None else None
+    for request in requests:
+        remaining = None if deadline is None else max(deadline - time.time(), 0)
+        request.wait(remaining)
+    return [request for request in requests if request.done()]
+
+class CommandScheduler(object):
+    """
+    Pipelines AT commands. Every request gets its own frame ID so the
+    responses can be matched to it, at most 'node_window' requests are in flight
+    per node and 'window' in the whole network, the rest wait in per node queues
+    that are served in turns. Requests without response after 'timeout' seconds
+    are sent again up to 'retries' times.
+    Nothing blocks, so it can be used from the radio reader thread.
+    """
+
+    window = 8
+    node_window = 1
+    timeout = 5
+    retries = 2
+
+    # seconds between timeout checks
+    interval = .5
+
+    logger = None
+
+    def __init__(self, transmit):
+        """
+        Constructor, transmit is called with every command to send
+        """
+        self.transmit = transmit
+        self.sent = 0
+        self.completed = 0
+        self.retried = 0
+        self.failed = 0
+        self._queues = {}
+        self._turns = deque()
+        self._inflight = {}
+        self._nodes = {}
+        self._frame_id = 0
+        self._lock = threading.RLock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __len__(self):
+        return len(self._inflight) + sum(len(queue) for queue in self._queues.itervalues())
+
+    def log(self, level, message):
+        if self.logger:
+            self.logger.log(level, message)
+
+    def start(self):
+        """
+        Starts the timeout thread
+        """
+        self._stop.clear()
+        self._thread = threading.Thread(target=self.run, name='command-scheduler')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stops the timeout thread
+        """
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+    def run(self):
+        """
+        Timeout thread
+        """
+        while not self._stop.wait(self.interval):
+            self.expire()
+
+    def submit(self, address, command, parameter=None, timeout=None, retries=None):
+        """
+        Queues an AT command for the node with the given (hex) address,
+        or for the local radio if there is no address.
+        Returns the request, timeout and retries override the defaults.
+        """
+        request = Command(address, command, parameter, timeout, retries)
+        with self._lock:
+            queue = self._queues.get(address, None)
+            if queue is None:
+                queue = self._queues[address] = deque()
+                self._turns.append(address)
+            queue.append(request)
+        self.pump()
+        return request
+
+    def pump(self):
+        """
+        Sends queued commands while the windows allow it,
+        taking one command from every node in turn
+        """
+        with self._lock:
+            # number of nodes in a row whose window is full
+            blocked = 0
+            while self._turns and blocked < len(self._turns) and len(self._inflight) < self.window:
+                address = self._turns.popleft()
+                queue = self._queues[address]
+                if self._nodes.get(address, 0) < self.node_window:
+                    self.send(queue.popleft())
+                    blocked = 0
+                else:
+                    blocked += 1
+                if queue:
+                    self._turns.append(address)
+                else:
+                    del self._queues[address]
+
+    def send(self, request):
+        """
+        Assigns a free frame ID to the command and transmits it
+        """
+        request.frame_id = self.next_frame_id()
+        request.attempts += 1
+        request.deadline = time.time() + (request.timeout or self.timeout)
+        self._inflight[request.frame_id] = request
+        self._nodes[request.address] = self._nodes.get(request.address, 0) + 1
+        self.sent += 1
+        try:
+            self.transmit(request)
+        except Exception as e:
+            self.log(logging.ERROR, "Error sending command %s to %s (%s)" % (request.command, request.address, e))
+
+    def next_frame_id(self):
+        """
+        Returns the next frame ID not in flight, 0 means no response so it is skipped
+        """
+        for i in range(255):
+            self._frame_id = self._frame_id % 255 + 1
+            if self._frame_id not in self._inflight:
+                return self._frame_id
+        raise RuntimeError("No free frame IDs")
+
+    def release(self, request):
+        """
+        Removes a command from the in flight ones
+        """
+        del self._inflight[request.frame_id]
+        count = self._nodes[request.address] - 1
+        if count:
+            self._nodes[request.address] = count
+        else:
+            del self._nodes[request.address]
+
+    def retry(self, request):
+        """
+        Queues a command again ahead of the other commands for the same node,
+        returns False if there are no retries left
+        """
+        if request.attempts > (request.retries if request.retries is not None else self.retries):
+            return False
+        queue = self._queues.get(request.address, None)
+        if queue is None:
+            queue = self._queues[request.address] = deque()
+            self._turns.appendleft(request.address)
+        queue.appendleft(request)
+        self.retried += 1
+        return True
+
+    def complete(self, frame_id, command, status, response):
+        """
+        Matches an AT command response to its request by frame ID and command,
+        returns the request or None if it is unknown or timed out
+        """
+        with self._lock:
+            request = self._inflight.get(frame_id, None)
+            if request is None or request.command != command:
+                return None
+            self.release(request)
+            # the radio could not deliver it, worth another try
+            retried = status == '\x04' and self.retry(request)
+        self.pump()
+        if retried:
+            return request
+        self.completed += 1
+        request.resolve(status, response)
+        return request
+
+    def expire(self, now=None):
+        """
+        Retries or fails the commands that timed out
+        """
+        now = now or time.time()
+        failed = []
+        with self._lock:
+            for request in self._inflight.values():
+                if request.deadline <= now:
+                    self.release(request)
+                    if not self.retry(request):
+                        failed.append(request)
+        self.pump()
+        for request in failed:
+            self.failed += 1
+            self.log(logging.WARNING, "Command %s to %s timed out after %d attempts" % \
+                (request.command, request.address, request.attempts))
+            request.resolve(None, None)
@@ -0,0 +1,145 @@
+#! /usr/bin/python
+# -*- coding: utf-8 -*-
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
+
+#   Xbee to MQTT gateway
+#   Copyright (C) 2012 by Xose Pérez
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+__author__ = "Xose Pérez"
+__contact__ = "xose.perez@gmail.com"
+__copyright__ = "Copyright (C) Xose Pérez"
+__license__ = 'GPL v3'
+
+import os
+import time
+import zlib
+import Queue
+import logging
+import multiprocessing
+
+class ShardPool(object):
+    """
+    Pool of worker processes.
+    Events are dispatched to a worker chosen by hashing the radio address,
+    so the events of every node are always processed in order by the same worker.
+    """
+
+    queue_size = 10000
+
+    # seconds between reports of dropped events
+    report_interval = 60
+
+    logger = None
+
+    def __init__(self, size):
+        """
+        Constructor, creates the event queues and the shared command queue
+        """
+        self.size = size
+        self.queues = [multiprocessing.Queue(self.queue_size) for index in range(size)]
+        self.commands = multiprocessing.Queue()
+        self.processes = []
+        self.dropped = 0
+        self._report_time = 0
+
+    def log(self, level, message):
+        if self.logger:
+            self.logger.log(level, message)
+
+    def start(self, target):
+        """
+        Forks the workers, target(index, queue, commands) runs in every one of them
+        """
+        for index, queue in enumerate(self.queues):
+            process = multiprocessing.Process(
+                target=target,
+                args=(index, queue, self.commands),
+                name='xbee2mqtt-worker-%d' % index
+            )
+            process.daemon = True
+            process.start()
+            self.processes.append(process)
+            self.log(logging.INFO, "Started worker %d (pid %d)" % (index, process.pid))
+
+    def stop(self):
+        """
+        Asks the workers to finish and waits for them
+        """
+        for queue in self.queues:
+            try:
+                queue.put(None, True, 1)
+            except Queue.Full:
+                pass
+        for process in self.processes:
+            process.join(5)
+
+    def shard(self, address):
+        """
+        Returns the worker index for a given address
+        """
+        return (zlib.crc32(address) & 0xffffffff) % self.size
+
+    def dispatch(self, address, *event):
+        """
+        Queues an event for the worker owning the address,
+        events for a worker that is not keeping up are dropped so the radios never block
+        """
+        index = self.shard(address)
+        try:
+            self.queues[index].put(event, False)
+        except Queue.Full:
+            self.dropped += 1
+            self.report(index)
+
+    def report(self, index):
+        """
+        Logs the dropped events and whether the worker is still running
+        """
+        now = time.time()
+        if now - self._report_time < self.report_interval:
+            return
+        self._report_time = now
+        alive = index >= len(self.processes) or self.processes[index].is_alive()
+        self.log(logging.ERROR if not alive else logging.WARNING, "Worker %d %s, %d events dropped" % \
+            (index, 'is not keeping up' if alive else 'is not running', self.dropped))
+
+    @staticmethod
+    def consume(queue, handler, idle=None, timeout=1):
+        """
+        Runs in the workers, passes every event in the queue to the handler
+        until the pool is stopped or the parent process goes away.
+        Errors handling an event are logged and do not stop the worker.
+        The idle callback is called at least once every timeout seconds.
+        """
+        parent = os.getppid()
+        last = time.time()
+        while True:
+            try:
+                event = queue.get(True, timeout)
+            except (Queue.Empty, IOError, OSError):
+                # timed out or interrupted by a signal
+                event = ()
+            if event is None or os.getppid() != parent:
+                break
+            if event:
+                try:
+                    handler(*event)
+                except Exception as e:
+                    logging.exception("Error handling %s event (%s)" % (event[0], e))
+            now = time.time()
+            if idle and now - last >= timeout:
+                idle()
+                last = now
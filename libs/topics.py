@@ -0,0 +1,217 @@
+#! /usr/bin/python
+# -*- coding: utf-8 -*-
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
+
+#   Xbee to MQTT gateway
+#   Copyright (C) 2012 by Xose Pérez
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+__author__ = "Xose Pérez"
+__contact__ = "xose.perez@gmail.com"
+__copyright__ = "Copyright (C) Xose Pérez"
+__license__ = 'GPL v3'
+
+import re
+
+class TopicNode(object):
+    """
+    Topic trie node, one per topic level
+    """
+
+    __slots__ = ['children', 'value', 'terminal']
+
+    def __init__(self):
+        self.children = {}
+        self.value = None
+        self.terminal = False
+
+class TopicTrie(object):
+    """
+    Maps MQTT topic filters with + and # wildcards to values.
+    Matching a concrete topic walks the trie level by level,
+    so the cost depends on the topic depth and not on the number of filters.
+    """
+
+    def __init__(self):
+        """
+        Constructor, creates the root node
+        """
+        self._root = TopicNode()
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    @staticmethod
+    def is_wildcard(topic):
+        """
+        Checks whether the topic contains any wildcard level
+        """
+        for level in topic.split('/'):
+            if level in ['+', '#']:
+                return True
+        return False
+
+    def add(self, pattern, value):
+        """
+        Stores a value for the given topic filter
+        """
+        levels = pattern.split('/')
+        if '#' in levels[:-1]:
+            raise ValueError("'#' must be the last level of topic filter %s" % pattern)
+        node = self._root
+        for level in levels:
+            node = node.children.setdefault(level, TopicNode())
+        if not node.terminal:
+            self._size += 1
+        node.value = value
+        node.terminal = True
+
+    def match(self, topic, default=None):
+        """
+        Returns the value for the most specific filter matching the topic.
+        Literal levels take precedence over '+' and '+' over '#',
+        comparing level by level from the start of the topic.
+        """
+        node = self._match(self._root, topic.split('/'), 0)
+        return node.value if node else default
+
+    def _match(self, node, levels, index):
+        if index == len(levels):
+            if node.terminal:
+                return node
+            # 'a/#' also matches 'a'
+            child = node.children.get('#', None)
+            return child if child and child.terminal else None
+
+        for key in (levels[index], '+'):
+            child = node.children.get(key, None)
+            if child is not None:
+                found = self._match(child, levels, index + 1)
+                if found:
+                    return found
+
+        child = node.children.get('#', None)
+        if child is not None and child.terminal:
+            return child
+        return None
+
+class TopicPattern(object):
+    """
+    Topic pattern with {address}, {port} and {item} placeholders.
+    The pattern is analysed once and expanded topics are cached per address and port.
+    """
+
+    cache_size = 4096
+
+    _cleanup = re.compile('//+|/$')
+    _placeholder = re.compile('{(\w+)}')
+
+    _ports = {
+        'analog': 'adc-',
+        'digital': 'dio-',
+        'config': 'pin-',
+    }
+
+    def __init__(self, pattern):
+        """
+        Constructor, analyses the pattern
+        """
+        self.pattern = pattern
+        self.has_item = '{item}' in pattern
+        self.regexp = self.compile(pattern)
+        self._cache = {}
+
+    def compile(self, pattern):
+        """
+        Compiles the pattern into an anchored regular expression
+        with a named group for each placeholder
+        """
+        expression = []
+        names = set()
+        position = 0
+        for match in self._placeholder.finditer(pattern):
+            expression.append(re.escape(pattern[position:match.start()]))
+            name = match.group(1)
+            if name in names:
+                expression.append('(?P=%s)' % name)
+            else:
+                expression.append('(?P<%s>[^/]%s)' % (name, '*' if name == 'item' else '+'))
+                names.add(name)
+            position = match.end()
+        expression.append(re.escape(pattern[position:]))
+        return re.compile('^%s$' % ''.join(expression))
+
+    @staticmethod
+    def item(port):
+        """
+        Returns the item name for a given port
+        """
+        prefix = port[:4]
+        if prefix == 'adc-':
+            return 'analog'
+        elif prefix == 'dio-':
+            return 'digital'
+        elif prefix == 'pin-':
+            return 'config'
+        return ''
+
+    def format(self, address, port):
+        """
+        Returns the topic for the given address and port
+        """
+        key = (address, port)
+        topic = self._cache.get(key, None)
+        if topic is None:
+            topic = self.expand(address, port)
+            if len(self._cache) >= self.cache_size:
+                self._cache.clear()
+            self._cache[key] = topic
+        return topic
+
+    def expand(self, address, port):
+        """
+        Expands the pattern, if there is an {item} placeholder adc/dio ports are
+        renamed to pin ports to keep compatibility with old topic patterns schemas.
+        """
+        if self.has_item:
+            item = self.item(port)
+            if item:
+                port = "pin-%s" % port[4:]
+            topic = self.pattern.format(address=address, port=port, item=item)
+        else:
+            topic = self.pattern.format(address=address, port=port)
+
+        # Clean excess slashes.
+        return self._cleanup.sub('', topic).rstrip('/')
+
+    def parse(self, topic):
+        """
+        Extracts the address and port from a topic matching the pattern,
+        pin ports under an {item} are renamed back to adc/dio ports.
+        Returns None if the topic does not match.
+        """
+        match = self.regexp.match(topic)
+        if match is None:
+            return None
+        values = match.groupdict()
+        address = values.get('address', None)
+        port = values.get('port', None)
+        if address is None or port is None:
+            return None
+        prefix = self._ports.get(values.get('item', None), None)
+        if prefix:
+            port = prefix + port[4:]
+        return address, port
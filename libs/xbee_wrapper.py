@@ -29,7 +29,12 @@ import glob
 import time
 import binascii
 import logging
+import threading
 from xbee import ZigBee as XBee
+from frames import FrameDecoder
+from lines import LineAssembler
+from samples import SampleDecoder, IO_SAMPLE
+from scheduler import CommandScheduler, STATUS
 
 class XBeeWrapper(object):
     """
@@ -43,13 +48,29 @@ class XBeeWrapper(object):
     serial = None
     xbee = None
     logger = None
+    scheduler = None
 
     sample_rate = 0
     change_detection = False
 
+    # API mode 2
+    escaped = False
+
+    # read frames with the built-in decoder instead of the python-xbee thread
+    native_decoder = False
+
     _change_detection_masks = {}
 
-    buffer = dict()
+    def __init__(self):
+        """
+        Constructor, initializes the per radio state
+        """
+        self._change_detection_masks = {}
+        self.scheduler = CommandScheduler(self.transmit)
+        self.lines = LineAssembler()
+        self.sample_decoder = SampleDecoder()
+        self._reader = None
+        self._reading = False
 
     def errorlog(self, e):
         logging.exception(e)
@@ -62,7 +83,12 @@ class XBeeWrapper(object):
         """
         Closes serial port
         """
+        self.scheduler.stop()
         self.xbee.halt()
+        if self._reader:
+            self._reading = False
+            self._reader.join(1)
+            self._reader = None
         self.serial.close()
         return True
 
@@ -72,11 +98,104 @@ class XBeeWrapper(object):
         """
         try:
             self.log(logging.INFO, "Connecting to Xbee")
-            self.xbee = XBee(self.serial, callback=self.process, error_callback=self.errorlog)
+            if self.native_decoder:
+                # only used to build and parse frames
+                self.xbee = XBee(self.serial, escaped=self.escaped)
+                if not hasattr(self.xbee, '_split_response'):
+                    self.log(logging.ERROR, "The built-in decoder requires python-xbee 2.x to parse frames")
+                    return False
+                self._reading = True
+                self._reader = threading.Thread(target=self.read, name='xbee-reader')
+                self._reader.daemon = True
+                self._reader.start()
+            else:
+                self.xbee = XBee(self.serial, callback=self.process, error_callback=self.errorlog, escaped=self.escaped)
         except:
             return False
+        self.scheduler.logger = self.logger
+        self.scheduler.start()
         return True
 
+    def read(self):
+        """
+        Reader thread for the built-in decoder,
+        reads everything waiting in the serial port at once
+        """
+        decoder = FrameDecoder(self.escaped)
+        while self._reading:
+            try:
+                data = self.serial.read(self.waiting() or 1)
+                if not data:
+                    time.sleep(.01)
+                    continue
+                errors = decoder.errors
+                for frame in decoder.feed(data):
+                    self.dispatch(frame)
+                if decoder.errors > errors:
+                    self.log(logging.DEBUG, "Discarded %d invalid frames" % (decoder.errors - errors))
+            except Exception as e:
+                if self._reading:
+                    self.errorlog(e)
+                    time.sleep(.1)
+
+    def waiting(self):
+        """
+        Bytes waiting in the serial port, pyserial before 3.0 only has inWaiting()
+        """
+        try:
+            return self.serial.in_waiting
+        except AttributeError:
+            return self.serial.inWaiting()
+
+    def split(self, frame):
+        """
+        Parses the data of a frame into a python-xbee response dictionary,
+        python-xbee has no public API for it so it is only used from here
+        """
+        return self.xbee._split_response(frame)
+
+    def dispatch(self, frame):
+        """
+        Processes the data of a frame from the built-in decoder,
+        IO samples are decoded straight into sample records
+        """
+        decoded = self.sample_decoder.decode(frame) if frame[:1] == IO_SAMPLE else None
+        if decoded:
+            self.on_samples(*decoded)
+        else:
+            self.process(self.split(frame))
+
+    def transmit(self, request):
+        """
+        Sends an AT command request from the scheduler
+        """
+        kwargs = {}
+        if request.parameter is not None:
+            kwargs['parameter'] = request.parameter
+        if request.address is None:
+            self.xbee.at(command = request.command, frame_id = chr(request.frame_id), **kwargs)
+        else:
+            self.xbee.remote_at(
+                dest_addr_long = binascii.unhexlify(request.address),
+                command = request.command,
+                frame_id = chr(request.frame_id),
+                **kwargs
+            )
+
+    def at(self, command, parameter = None, timeout = None, retries = None):
+        """
+        Queues an AT command for the local radio, returns the request
+        that resolves with the response status and parameter
+        """
+        return self.scheduler.submit(None, command, parameter, timeout, retries)
+
+    def remote_at(self, address, command, parameter = None, timeout = None, retries = None):
+        """
+        Queues an AT command for a remote radio, returns the request
+        that resolves with the response status and parameter
+        """
+        return self.scheduler.submit(address, command, parameter, timeout, retries)
+
     def process(self, packet):
         """
         Processes an incoming packet, supported packet frame ids:
@@ -101,30 +220,22 @@ class XBeeWrapper(object):
 
             # Some streams arrive split in different packets
             # we buffer the data until we get an EOL
-            self.buffer[address] = self.buffer.get(address,'') + packet['rf_data']
-            count = self.buffer[address].count('\n')
-            if (count):
-                lines = self.buffer[address].splitlines()
-                try:
-                    self.buffer[address] = lines[count:][0]
-                except:
-                    self.buffer[address] = ''
-                for line in lines[:count]:
-                    line = line.rstrip()
-                    try:
-                        port, value = line.split(':', 1)
-                    except:
-                        value = line
-                        port = self.default_port_name
-                    self.on_message(address, port, value)
+            for line in self.lines.feed(address, packet['rf_data']):
+                self.process_line(address, line)
+            for node, line in self.lines.expire():
+                self.process_line(node, line)
 
         # Data received from an IO data sample
         elif (id == "rx_io_data_long_addr"):
+            samples = []
             for sample in packet['samples']:
+                values = {}
                 for port, value in sample.iteritems():
                     if port[:4] == 'dio-':
                         value = 1 if value else 0
-                    self.on_message(address, port, value)
+                    values[port] = value
+                samples.append(values)
+            self.on_samples(address, samples)
 
         # Node Identification Indicator received
         elif (id == "node_id_indicator"):
@@ -136,6 +247,7 @@ class XBeeWrapper(object):
             status = packet.get('status', None)
             command = packet.get('command', None)
             response = packet.get('parameter', None)
+            self.scheduler.complete(ord(packet.get('frame_id', '\x00')), command, status, response)
             self.on_response(status, command, response, "local")
 
         # Response received after a remote command request
@@ -143,8 +255,22 @@ class XBeeWrapper(object):
             status = packet.get('status', None)
             command = packet.get('command', None)
             response = packet.get('parameter', None)
+            self.scheduler.complete(ord(packet.get('frame_id', '\x00')), command, status, response)
             self.on_response(status, command, response, address)
 
+    def process_line(self, address, line):
+        """
+        Processes a line sent through the UART of a remote radio as "port:value"
+        or just "value" for the default port
+        """
+        line = line.rstrip()
+        try:
+            port, value = line.split(':', 1)
+        except:
+            value = line
+            port = self.default_port_name
+        self.on_message(address, port, value)
+
     def on_identification(self, address, alias):
         """
         Hook for node identification message.
@@ -161,18 +287,7 @@ class XBeeWrapper(object):
         """
         Hook for command responses.
         """
-        if (status == '\x00'):
-            status_msg = "OK"
-        elif (status == '\x01'):
-            status_msg = "ERROR"
-        elif (status == '\x02'):
-            status_msg = "Invalid Command"
-        elif (status == '\x03'):
-            status_msg = "Invalid Parameter"
-        elif (status == '\x04'):
-            status_msg = "Tx Failure"
-        else:
-            status_msg = "Unknown"
+        status_msg = STATUS.get(status, "Unknown")
 
         self.log(logging.INFO,
             "AT response for command: %s, status: %s" % (command, status_msg)
@@ -191,8 +306,7 @@ class XBeeWrapper(object):
             milliseconds = str(hex(self.sample_rate * 1000))[2:]
             milliseconds = '0' * (len(milliseconds) % 2) + milliseconds
             milliseconds = binascii.unhexlify(milliseconds)
-            source_addr_long = response['source_addr_long']
-            self.xbee.remote_at(dest_addr_long = source_addr_long, command = 'IR', parameter = milliseconds)
+            self.remote_at(address, 'IR', milliseconds)
 
             self.on_node_discovery(address, alias)
 
@@ -207,12 +321,13 @@ class XBeeWrapper(object):
                 new_mask = str(hex(new_mask))[2:]
                 new_mask = '0' * (len(new_mask) % 2) + new_mask
                 new_mask = binascii.unhexlify(new_mask)
-                source_addr_long = binascii.unhexlify(address)
-                self.xbee.remote_at(dest_addr_long = source_addr_long, command = 'IC', parameter = new_mask)
-                self.xbee.remote_at(dest_addr_long = source_addr_long, command = 'WR')
+                self.remote_at(address, 'IC', new_mask)
+                self.remote_at(address, 'WR')
 
-        # Process retrieved pin status
+        # Process retrieved pin status, pin changes are confirmed by send_message
         elif (re.match('[DP]\d', command)):
+            if not response:
+                return
             prefix, number = command[:1], command[1:]
             port = 'pin-1%s' % number if (prefix == 'P') else 'pin-%s' % number
             value = int(binascii.hexlify(response), 16)
@@ -226,9 +341,20 @@ class XBeeWrapper(object):
         """
         None
 
+    def on_samples(self, address, samples):
+        """
+        Hook for the IO samples in a frame, a list of port/value dicts.
+        By default every value is sent as a message.
+        """
+        for sample in samples:
+            for port, value in sample.iteritems():
+                self.on_message(address, port, value)
+
     def send_query(self, address, ports = None):
         """
-        Request current configuration of given ports
+        Request current configuration of given ports,
+        the requests are queued in the scheduler so it does not block.
+        Returns the list of requests.
         """
         if ports is None:
             ports = [ "pin-%s" % x for x in range(13) ]
@@ -237,8 +363,8 @@ class XBeeWrapper(object):
             ports = [ports]
 
         self.log(logging.INFO, "Request configuration for %s at %s" % (ports, address))
-        address = binascii.unhexlify(address)
 
+        requests = []
         for port in ports:
 
             if port[:4] not in [ 'adc-', 'dio-', 'pin-' ]:
@@ -247,14 +373,17 @@ class XBeeWrapper(object):
             number = int(port[4:])
 
             command = 'P%d' % (number - 10) if number>9 else 'D%d' % number
-            self.xbee.remote_at(dest_addr_long = address, command = command, frame_id="A")
-            time.sleep(1)
+            requests.append(self.remote_at(address, command))
+
+        return requests
 
     def send_message(self, address, port, value, permanent = True):
         """
         Sends a message to a remote radio
         Currently, this only supports setting a digital output pin LOW (4) or HIGH (5)
         and setting a raw configuration for any pin of remote radio.
+        Returns the request that resolves once the radio confirms the change,
+        or None if the port is not supported.
         """
         self.log(logging.DEBUG,
             "Sending message to address: %s, port: %s, value: %s" % (address, port, value)
@@ -264,27 +393,33 @@ class XBeeWrapper(object):
 
             prefix = port[:4]
             if prefix in ['dio-', 'pin-']:
-                address = binascii.unhexlify(address)
                 number = int(port[4:])
                 command = 'P%d' % (number - 10) if number>9 else 'D%d' % number
                 value = int(value) % 10 if prefix == 'pin-' else (int(value) > 0) + 4
-                value = binascii.unhexlify('0' + str(value))
-                self.xbee.remote_at(dest_addr_long = address, command = command, parameter = value)
-                self.xbee.remote_at(dest_addr_long = address, command = 'WR' if permanent else 'AC')
-                self.xbee.remote_at(dest_addr_long = address, command = command, frame_id = 'A')
+
+                # the new pin configuration is reported once confirmed
+                def confirm(request):
+                    if request.ok:
+                        self.on_message(address, 'pin-%d' % number, value)
+
+                # remote commands are applied right away, WR stores them too
+                request = self.remote_at(address, command, binascii.unhexlify('0' + str(value)))
+                request.add_done_callback(confirm)
+                if permanent:
+                    self.remote_at(address, 'WR')
                 if self.change_detection:
-                    address = binascii.hexlify(address)
-                    self.issue_change_detection(address, port, value == '\x03')
+                    self.issue_change_detection(address, port, value == 3)
 
-                return True
+                return request
         except:
             pass
 
-        return False
+        return None
 
     def issue_change_detection(self, address, port, enabled = True):
         """
-        Sends IC command to check the response and change if it differs
+        Sends IC command to check the response and change if it differs,
+        returns the request
         """
         self.log(logging.DEBUG,
             "Sending IC command to address: %s, port: %s, enabled: %s" % (address, port, enabled)
@@ -296,8 +431,7 @@ class XBeeWrapper(object):
         else:
             self._change_detection_masks[address] = mask & ~(1 << offset)
 
-        address = binascii.unhexlify(address)
-        self.xbee.remote_at(dest_addr_long = address, command = 'IC', frame_id = 'A')
+        return self.remote_at(address, 'IC')
 
     def find_devices(self, vendor_id = None, product_id = None):
         """
@@ -65,14 +65,19 @@ class Serial(object):
         """
         return self.length - self.index
 
-    def read(self):
+    @property
+    def in_waiting(self):
         """
-        Feeds incoming bytes to the consumer
+        Number of bytes pending to read, pyserial 3 API
         """
-        response = None
-        if self.inWaiting() > 0:
-            response = self.stream[self.index]
-            self.index += 1
+        return self.inWaiting()
+
+    def read(self, size=1):
+        """
+        Feeds up to size incoming bytes to the consumer
+        """
+        response = self.stream[self.index:self.index + size]
+        self.index += len(response)
         return response
 
     def write(self, message):
@@ -0,0 +1,89 @@
+#! /usr/bin/python
+# -*- coding: utf-8 -*-
+
+__author__ = "Xose Pérez"
+__contact__ = "xose.perez@gmail.com"
+__copyright__ = "Copyright (C) Xose Pérez"
+__license__ = 'GPL v3'
+
+import unittest
+
+from libs.downsampler import Downsampler
+
+class TestDownsampler(unittest.TestCase):
+
+    summaries = []
+
+    def setUp(self):
+        self.summaries = []
+        self.downsampler = Downsampler()
+        self.downsampler.on_summary = self.on_summary
+
+    def on_summary(self, address, port, value):
+        self.summaries += [(address, port, value)]
+
+    def test_disabled(self):
+        self.downsampler.configure({})
+        self.assertFalse(self.downsampler.add('0013a200406bfd09', 'adc-7', 2816, 100))
+
+    def test_bucket(self):
+        self.downsampler.configure({'period': 10, 'function': 'mean'})
+        for now, value in [(100, 10), (103, 20), (109, 30), (110, 100)]:
+            self.assertTrue(self.downsampler.add('0013a200406bfd09', 'adc-7', value, now))
+        self.assertEquals([('0013a200406bfd09', 'adc-7', 20.0)], self.summaries)
+        self.downsampler.flush(115)
+        self.assertEquals(1, len(self.summaries))
+        self.downsampler.flush(120)
+        self.assertEquals(('0013a200406bfd09', 'adc-7', 100), self.summaries[1])
+
+    def test_overrides(self):
+        self.downsampler.configure({
+            'period': 60,
+            'function': 'last',
+            'routes': {
+                '0013a200406bfd09': {
+                    'adc-7': {'function': 'max'},
+                    'dio-12': {'period': 0},
+                },
+            },
+        })
+        self.assertFalse(self.downsampler.add('0013a200406bfd09', 'dio-12', 1, 100))
+        self.assertFalse(self.downsampler.add('0013a200406bfd09', 'serial', 'text', 100))
+        self.downsampler.add('0013a200406bfd09', 'adc-7', 5, 100)
+        self.downsampler.add('0013a200406bfd09', 'adc-7', 7, 101)
+        self.downsampler.add('0013a200406bfd09', 'adc-7', 6, 102)
+        self.downsampler.add('0013a200406bfd09', 'adc-1', '3', 102)
+        self.downsampler.flush(force=True)
+        self.assertEquals(sorted([
+            ('0013a200406bfd09', 'adc-7', 7),
+            ('0013a200406bfd09', 'adc-1', 3.0),
+        ]), sorted(self.summaries))
+
+    def test_summary(self):
+        self.downsampler.configure({'period': 10})
+        for now, value in [(100, 10), (103, 30), (109, 20)]:
+            self.downsampler.add('0013a200406bfd09', 'adc-7', value, now)
+        self.downsampler.flush(110)
+        self.assertEquals([('0013a200406bfd09', 'adc-7', {
+            'last': 20, 'mean': 20.0, 'min': 10, 'max': 30, 'count': 3
+        })], self.summaries)
+
+    def test_digital(self):
+        self.downsampler.configure({
+            'period': 10,
+            'function': 'mean',
+            'routes': {
+                '0013a200406bfd09': {
+                    'dio-3': {'function': 'max'},
+                },
+            },
+        })
+        self.assertFalse(self.downsampler.add('0013a200406bfd09', 'dio-12', 1, 100))
+        self.assertFalse(self.downsampler.add('0013a200406bfd09', 'pin-12', 4, 100))
+        self.assertTrue(self.downsampler.add('0013a200406bfd09', 'dio-3', 0, 100))
+        self.assertTrue(self.downsampler.add('0013a200406bfd09', 'dio-3', 1, 101))
+        self.downsampler.flush(force=True)
+        self.assertEquals([('0013a200406bfd09', 'dio-3', 1)], self.summaries)
+
+if __name__ == '__main__':
+    unittest.main()
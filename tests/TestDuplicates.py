@@ -0,0 +1,43 @@
+#! /usr/bin/python
+# -*- coding: utf-8 -*-
+
+__author__ = "Xose Pérez"
+__contact__ = "xose.perez@gmail.com"
+__copyright__ = "Copyright (C) Xose Pérez"
+__license__ = 'GPL v3'
+
+import unittest
+
+from libs.duplicates import DuplicateStore
+
+class TestDuplicates(unittest.TestCase):
+
+    def test_window(self):
+        store = DuplicateStore(5)
+        self.assertFalse(store.is_duplicate('/test/1', 1, 100))
+        self.assertTrue(store.is_duplicate('/test/1', 1, 104))
+        self.assertFalse(store.is_duplicate('/test/1', 2, 104))
+        self.assertFalse(store.is_duplicate('/test/1', 1, 105))
+        self.assertFalse(store.is_duplicate('/test/1', 1, 110))
+
+    def test_expire(self):
+        store = DuplicateStore(5)
+        store.is_duplicate('/test/1', 1, 100)
+        store.is_duplicate('/test/2', 1, 102)
+        store.is_duplicate('/test/3', 1, 106)
+        self.assertEquals(2, len(store))
+        store.is_duplicate('/test/4', 1, 120)
+        self.assertEquals(1, len(store))
+
+    def test_size(self):
+        store = DuplicateStore(5, 2)
+        store.is_duplicate('/test/1', 1, 100)
+        store.is_duplicate('/test/2', 1, 100)
+        store.is_duplicate('/test/1', 2, 101)
+        store.is_duplicate('/test/3', 1, 101)
+        self.assertEquals(2, len(store))
+        self.assertTrue(store.is_duplicate('/test/1', 2, 102))
+        self.assertFalse(store.is_duplicate('/test/2', 1, 102))
+
+if __name__ == '__main__':
+    unittest.main()
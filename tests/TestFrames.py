@@ -0,0 +1,61 @@
+#! /usr/bin/python
+# -*- coding: utf-8 -*-
+
+__author__ = "Xose Pérez"
+__contact__ = "xose.perez@gmail.com"
+__copyright__ = "Copyright (C) Xose Pérez"
+__license__ = 'GPL v3'
+
+import unittest
+import binascii
+
+from xbee.frame import APIFrame
+from libs.frames import FrameDecoder
+
+class TestFrames(unittest.TestCase):
+
+    data = binascii.unhexlify('920013a200406bfd090123010110008010000B00')
+
+    def frame(self, data, escaped=False):
+        return APIFrame(data, escaped).output()
+
+    def test_chunks(self):
+        decoder = FrameDecoder()
+        stream = self.frame(self.data) + self.frame('\x88\x01ND\x00')
+        frames = []
+        for i in range(0, len(stream), 7):
+            frames += decoder.feed(stream[i:i + 7])
+        self.assertEquals([self.data, '\x88\x01ND\x00'], frames)
+        self.assertEquals(0, len(decoder))
+
+    def test_resync(self):
+        decoder = FrameDecoder()
+        broken = self.frame(self.data)[:-1] + '\x00'
+        frames = decoder.feed('\x01\x02' + broken + self.frame(self.data))
+        self.assertEquals([self.data], frames)
+        self.assertEquals(1, decoder.errors)
+
+    def test_start_in_data(self):
+        decoder = FrameDecoder()
+        data = '\x90\x7e\x7d\x11\x13'
+        self.assertEquals([data], decoder.feed(self.frame(data)))
+
+    def test_escaped(self):
+        decoder = FrameDecoder(True)
+        data = '\x90\x7e\x7d\x11\x13' + self.data
+        stream = self.frame(data, True)
+        self.assertTrue('\x7d\x5e' in stream)
+        frames = []
+        for i in range(len(stream)):
+            frames += decoder.feed(stream[i])
+        self.assertEquals([data], frames)
+
+    def test_escaped_resync(self):
+        decoder = FrameDecoder(True)
+        truncated = self.frame(self.data, True)[:-3]
+        frames = decoder.feed('\x01' + truncated + self.frame(self.data, True))
+        self.assertEquals([self.data], frames)
+        self.assertEquals(1, decoder.errors)
+
+if __name__ == '__main__':
+    unittest.main()
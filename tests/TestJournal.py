@@ -0,0 +1,119 @@
+#! /usr/bin/python
+# -*- coding: utf-8 -*-
+
+__author__ = "Xose Pérez"
+__contact__ = "xose.perez@gmail.com"
+__copyright__ = "Copyright (C) Xose Pérez"
+__license__ = 'GPL v3'
+
+import os
+import shutil
+import tempfile
+import unittest
+import struct
+import zlib
+
+from libs.journal import Journal, Segment
+
+class TestJournal(unittest.TestCase):
+
+    path = None
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def journal(self):
+        journal = Journal(self.path)
+        journal.segment_size = 1024
+        journal.max_size = 4096
+        journal.open()
+        return journal
+
+    def replay(self, journal):
+        messages = []
+        while True:
+            message = journal.peek()
+            if message is None:
+                return messages
+            messages.append(message[:2])
+            journal.pop()
+
+    def test_replay(self):
+        journal = self.journal()
+        self.assertFalse(journal)
+        for index in range(100):
+            journal.append('/test/%d' % index, str(index))
+        self.assertTrue(journal)
+        journal.close()
+
+        journal = self.journal()
+        self.assertEquals([('/test/0', '0'), ('/test/1', '1')], self.replay(journal)[:2])
+        self.assertFalse(journal)
+
+    def test_size(self):
+        journal = self.journal()
+        for index in range(500):
+            journal.append('/test/%d' % index, str(index))
+        messages = self.replay(journal)
+        self.assertTrue(journal.dropped > 0)
+        self.assertEquals(500, len(messages) + journal.dropped)
+        self.assertEquals(('/test/499', '499'), messages[-1])
+
+    def test_torn_tail(self):
+        journal = self.journal()
+        journal.append('/test/1', '1')
+        journal.append('/test/2', '2')
+        journal.append('/test/3', '3')
+        segment = journal._segments[-1]
+        # corrupt the last record as a crash in the middle of a write would
+        segment.map[segment.write - 1] = 'X'
+        journal.close()
+
+        journal = self.journal()
+        journal.append('/test/4', '4')
+        self.assertEquals([('/test/1', '1'), ('/test/2', '2'), ('/test/4', '4')], self.replay(journal))
+
+    def test_age(self):
+        journal = self.journal()
+        journal.max_age = 60
+        journal.append('/test/old', '1', timestamp=1)
+        journal.append('/test/new', '2')
+        self.assertEquals([('/test/new', '2')], self.replay(journal))
+        self.assertEquals(1, journal.dropped)
+
+    def test_properties(self):
+        journal = self.journal()
+        journal.append('/test/1', '1', properties={'address': '0013a200406bfd09', 'timestamp': '1.000'})
+        journal.append('/test/2', '2')
+        journal.close()
+
+        journal = self.journal()
+        self.assertEquals(('/test/1', '1', 0, 0), journal.peek()[:4])
+        self.assertEquals({'address': '0013a200406bfd09', 'timestamp': '1.000'}, journal.peek()[5])
+        journal.pop()
+        self.assertEquals(None, journal.peek()[5])
+
+    def test_legacy(self):
+        # segment written before records had properties
+        segment = Segment(os.path.join(self.path, '%020d.journal' % 1), 1024)
+        segment.magic = Segment.legacy_magic
+        segment.record = Segment.legacy_record
+        segment.set_read(Segment.header.size)
+        offset = segment.write
+        for topic, payload in [('/test/1', '1'), ('/test/2', '2')]:
+            end = offset + Segment.legacy_record.size + len(topic) + len(payload)
+            segment.map[end - len(topic) - len(payload):end] = topic + payload
+            Segment.legacy_record.pack_into(segment.map, offset, 0, len(topic) + len(payload), 1, 0, 0, len(topic))
+            segment.map[offset:offset + 4] = struct.pack('<I', zlib.crc32(segment.map[offset + 4:end]) & 0xffffffff)
+            offset = end
+        segment.close()
+
+        journal = self.journal()
+        journal.append('/test/3', '3', properties={'address': 'a'})
+        self.assertEquals([('/test/1', '1'), ('/test/2', '2'), ('/test/3', '3')], self.replay(journal))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+#! /usr/bin/python
+# -*- coding: utf-8 -*-
+
+__author__ = "Xose Pérez"
+__contact__ = "xose.perez@gmail.com"
+__copyright__ = "Copyright (C) Xose Pérez"
+__license__ = 'GPL v3'
+
+import unittest
+
+from libs.lines import LineAssembler
+
+class TestLines(unittest.TestCase):
+
+    def test_split(self):
+        lines = LineAssembler()
+        self.assertEquals([], lines.feed('a', 'temp:2', 1))
+        self.assertEquals([], lines.feed('b', 'hum', 1))
+        self.assertEquals(['temp:21.5', 'status:1'], lines.feed('a', '1.5\nstatus:1\nst', 2))
+        self.assertEquals(['hum:40'], lines.feed('b', ':40\n', 2))
+        self.assertEquals(['status:0'], lines.feed('a', 'atus:0\n', 3))
+        self.assertEquals(0, len(lines))
+
+    def test_max_length(self):
+        lines = LineAssembler()
+        lines.max_length = 8
+        lines.feed('a', 'temp:123', 1)
+        self.assertEquals([], lines.feed('a', '4567', 1))
+        self.assertEquals(1, lines.dropped)
+        # the rest of the line is dropped too
+        self.assertEquals([], lines.feed('a', '89\n', 1))
+        self.assertEquals(['temp:1'], lines.feed('a', 'temp:1\n', 1))
+        self.assertEquals(0, len(lines))
+
+    def test_timeout(self):
+        lines = LineAssembler()
+        lines.timeout = 10
+        lines.feed('a', 'temp:2', 1)
+        self.assertEquals(['1'], lines.feed('a', '1\n', 11))
+        self.assertEquals(1, lines.dropped)
+
+    def test_flush(self):
+        lines = LineAssembler()
+        lines.timeout = 10
+        lines.flush = True
+        lines.feed('a', 'temp:2', 1)
+        lines.feed('b', 'temp:3', 5)
+        self.assertEquals([('a', 'temp:2')], lines.expire(12))
+        self.assertEquals(1, len(lines))
+
+    def test_max_nodes(self):
+        lines = LineAssembler()
+        lines.max_nodes = 2
+        for address in ['a', 'b', 'c']:
+            lines.feed(address, 'temp:2', 1)
+        self.assertEquals(2, len(lines))
+        self.assertEquals(['1'], lines.feed('a', '1\n', 1))
+
+    def test_max_nodes_flush(self):
+        lines = LineAssembler()
+        lines.max_nodes = 1
+        lines.flush = True
+        lines.feed('a', 'temp:2', 1)
+        lines.feed('b', 'temp:3', 1)
+        self.assertEquals([('a', 'temp:2')], lines.expire(1))
+        self.assertEquals([], lines.expire(1))
+
+if __name__ == '__main__':
+    unittest.main()
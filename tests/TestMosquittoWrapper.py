@@ -0,0 +1,166 @@
+#! /usr/bin/python
+# -*- coding: utf-8 -*-
+
+__author__ = "Xose Pérez"
+__contact__ = "xose.perez@gmail.com"
+__copyright__ = "Copyright (C) Xose Pérez"
+__license__ = 'GPL v3'
+
+import json
+import time
+import unittest
+
+from paho.mqtt.client import MQTTv5, MQTT_ERR_NO_CONN
+from libs.mosquitto_wrapper import MosquittoWrapper
+
+class Client(MosquittoWrapper):
+
+    def __init__(self, *args, **kwargs):
+        MosquittoWrapper.__init__(self, *args, **kwargs)
+        self.requests = []
+        self.published = []
+
+    def publish(self, topic, value, qos=None, retain=None, properties=None):
+        self.published.append((topic, value))
+
+    def send_subscribe(self, topics):
+        self.requests.append(('subscribe', topics))
+        return 0, len(self.requests)
+
+    def send_unsubscribe(self, topics):
+        self.requests.append(('unsubscribe', topics))
+        return 0, len(self.requests)
+
+class TestMosquittoWrapper(unittest.TestCase):
+
+    def test_no_aliases(self):
+        mqtt = MosquittoWrapper('test')
+        self.assertEquals(('/raw/xbee/1/adc-1', None), mqtt.alias('/raw/xbee/1/adc-1'))
+        self.assertEquals(('/raw/xbee/1/adc-1', None), mqtt.alias('/raw/xbee/1/adc-1'))
+
+    def test_aliases(self):
+        mqtt = MosquittoWrapper('test', protocol=MQTTv5)
+        mqtt._alias_maximum = 2
+        self.assertEquals(('/raw/xbee/1/adc-1', 1), mqtt.alias('/raw/xbee/1/adc-1'))
+        self.assertEquals(('/raw/xbee/1/adc-2', 2), mqtt.alias('/raw/xbee/1/adc-2'))
+        self.assertEquals(('', 1), mqtt.alias('/raw/xbee/1/adc-1'))
+        # adc-2 is the least recently used topic
+        self.assertEquals(('/raw/xbee/1/adc-3', 2), mqtt.alias('/raw/xbee/1/adc-3'))
+        self.assertEquals(('/raw/xbee/1/adc-2', 1), mqtt.alias('/raw/xbee/1/adc-2'))
+        self.assertEquals(('', 2), mqtt.alias('/raw/xbee/1/adc-3'))
+
+    def test_reinitialise(self):
+        mqtt = MosquittoWrapper('test', protocol=MQTTv5)
+        mqtt.reinitialise('test-1')
+        self.assertEquals(MQTTv5, mqtt._protocol)
+        self.assertEquals('test-1', mqtt._client_id)
+
+    def test_subscriptions_diff(self):
+        mqtt = Client('test')
+        mqtt.subscribe(['/a', '/b'])
+        mqtt.unsubscribe('/a')
+        self.assertEquals([], mqtt.requests)
+        mqtt.connected = True
+        mqtt.sync_subscriptions()
+        self.assertEquals([('subscribe', ['/b'])], mqtt.requests)
+        # changes wait for the next sync and are sent batched
+        mqtt.subscribe('/c')
+        mqtt.subscribe('/d')
+        mqtt.unsubscribe('/b')
+        self.assertEquals(1, len(mqtt.requests))
+        mqtt.sync_subscriptions()
+        self.assertEquals([
+            ('subscribe', ['/b']),
+            ('subscribe', ['/c', '/d']),
+            ('unsubscribe', ['/b']),
+        ], mqtt.requests)
+        self.assertEquals(set(['/c', '/d']), mqtt._subscribed)
+        # nothing to send if the desired subscriptions did not change
+        mqtt.subscribe('/c')
+        mqtt.unsubscribe('/b')
+        mqtt.sync_subscriptions()
+        self.assertEquals(3, len(mqtt.requests))
+
+    def test_subscriptions_batch(self):
+        mqtt = Client('test')
+        mqtt.subscription_batch_size = 2
+        mqtt.subscribe(['/a', '/b', '/c', '/d', '/e'])
+        mqtt.connected = True
+        mqtt.sync_subscriptions()
+        self.assertEquals([
+            ('subscribe', ['/a', '/b']),
+            ('subscribe', ['/c', '/d']),
+            ('subscribe', ['/e']),
+        ], mqtt.requests)
+        mqtt.unsubscribe(['/a', '/b', '/c'])
+        mqtt.sync_subscriptions()
+        self.assertEquals([
+            ('unsubscribe', ['/a', '/b']),
+            ('unsubscribe', ['/c']),
+        ], mqtt.requests[3:])
+
+    def test_subscriptions_reconnect(self):
+        mqtt = Client('test')
+        mqtt.subscribe(['/a', '/b'])
+        mqtt._MosquittoWrapper__on_connect(mqtt, None, {}, 0)
+        self.assertEquals([('subscribe', ['/a', '/b'])], mqtt.requests)
+        mqtt._MosquittoWrapper__on_disconnect(mqtt, None, 1)
+        mqtt.subscribe('/c')
+        mqtt._MosquittoWrapper__on_connect(mqtt, None, {}, 0)
+        self.assertEquals([
+            ('subscribe', ['/a', '/b']),
+            ('subscribe', ['/a', '/b', '/c']),
+        ], mqtt.requests)
+
+    def test_backoff(self):
+        mqtt = Client('test')
+        mqtt.reconnect_min_delay = 1
+        mqtt.reconnect_max_delay = 8
+        backoffs = []
+        for i in range(6):
+            now = time.time()
+            mqtt.schedule()
+            backoffs.append(mqtt._backoff)
+            delay = mqtt._next_attempt - now
+            self.assertTrue(mqtt._backoff / 2.0 <= delay <= mqtt._backoff + 0.1)
+        self.assertEquals([1, 2, 4, 8, 8, 8], backoffs)
+        # connecting resets the backoff
+        mqtt._MosquittoWrapper__on_connect(mqtt, None, {}, 0)
+        self.assertEquals(0, mqtt._backoff)
+        mqtt.schedule()
+        self.assertEquals(1, mqtt._backoff)
+
+    def test_pending_attempt(self):
+        mqtt = Client('test')
+        mqtt.host = '127.0.0.1'
+        mqtt.port = 1
+        mqtt._next_attempt = time.time() + 10
+        start = time.time()
+        self.assertEquals(MQTT_ERR_NO_CONN, mqtt.loop(.05))
+        self.assertTrue(time.time() - start < 1)
+        self.assertEquals(0, mqtt.connect_attempts)
+        # a due attempt that fails schedules the next one without blocking
+        mqtt._next_attempt = time.time()
+        self.assertEquals(MQTT_ERR_NO_CONN, mqtt.loop(.05))
+        self.assertTrue(time.time() - start < 1)
+        self.assertEquals(1, mqtt.connect_attempts)
+        self.assertTrue(mqtt._next_attempt > time.time())
+
+    def test_metrics(self):
+        mqtt = Client('test')
+        mqtt.connect_attempts = 3
+        mqtt._MosquittoWrapper__on_connect(mqtt, None, {}, 0)
+        mqtt._MosquittoWrapper__on_disconnect(mqtt, None, 1)
+        mqtt.connect_attempts = 1
+        mqtt._MosquittoWrapper__on_connect(mqtt, None, {}, 0)
+        self.assertEquals(['/service/test/status', '/service/test/connection'] * 2, [topic for topic, value in mqtt.published])
+        metrics = json.loads(mqtt.published[1][1])
+        self.assertEquals((3, 1, 0), (metrics['attempts'], metrics['connections'], metrics['disconnections']))
+        metrics = json.loads(mqtt.published[3][1])
+        self.assertEquals((1, 2, 1), (metrics['attempts'], metrics['connections'], metrics['disconnections']))
+        self.assertEquals(mqtt.connected_since, metrics['connected_since'])
+        self.assertEquals(mqtt.disconnected_since, metrics['disconnected_since'])
+        self.assertEquals(0, mqtt.connect_attempts)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,53 @@
+#! /usr/bin/python
+# -*- coding: utf-8 -*-
+
+__author__ = "Xose Pérez"
+__contact__ = "xose.perez@gmail.com"
+__copyright__ = "Copyright (C) Xose Pérez"
+__license__ = 'GPL v3'
+
+import unittest
+
+from libs import payloads
+from libs.payloads import CodecFactory, PayloadEncoder
+
+class TestPayloads(unittest.TestCase):
+
+    def test_text(self):
+        codec = CodecFactory('text')
+        self.assertEquals('2816', codec.encode(2816))
+        self.assertEquals('Open', codec.encode('Open'))
+        self.assertEquals('{"adc-7": 2816, "ts": 1.5}', codec.encode({'ts': 1.5, 'adc-7': 2816}))
+
+    def test_json(self):
+        codec = CodecFactory('json')
+        self.assertEquals('2.5', codec.encode(2.5))
+        self.assertEquals('"1"', codec.encode('1'))
+        self.assertEquals('{"adc-7":2816,"dio-12":1}', codec.encode({'dio-12': 1, 'adc-7': 2816}))
+
+    def test_unknown(self):
+        self.assertEquals(None, CodecFactory('xml'))
+        encoder = PayloadEncoder()
+        encoder.configure({'codec': 'xml'})
+        self.assertEquals('text', encoder.codec.name)
+
+    def test_topics(self):
+        encoder = PayloadEncoder()
+        encoder.configure({'codec': 'json', 'topics': {'/raw/xbee/+/serial': 'text'}})
+        self.assertEquals('"on"', encoder.encode('/raw/xbee/1/status', 'on'))
+        self.assertEquals('on', encoder.encode('/raw/xbee/1/serial', 'on'))
+
+    @unittest.skipIf(payloads.msgpack is None, "msgpack not installed")
+    def test_msgpack(self):
+        codec = CodecFactory('msgpack')
+        self.assertEquals('\xcd\x0b\x00', codec.encode(2816))
+        self.assertEquals({u'adc-7': 2816, u'status': u'on'}, payloads.msgpack.unpackb(codec.encode({'adc-7': 2816, 'status': 'on'}), raw=False))
+
+    @unittest.skipIf(payloads.cbor2 is None, "cbor2 not installed")
+    def test_cbor(self):
+        codec = CodecFactory('cbor')
+        self.assertEquals('\x19\x0b\x00', codec.encode(2816))
+        self.assertEquals(u'on', payloads.cbor2.loads(codec.encode('on')))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -6,6 +6,7 @@ __contact__ = "xose.perez@gmail.com"
 __copyright__ = "Copyright (C) Xose Pérez"
 __license__ = 'GPL v3'
 
+import time
 import unittest
 
 from libs.processor import Processor
@@ -35,6 +36,21 @@ class TestProcessor(unittest.TestCase):
         })
         self.assertEquals(997.54, processor.process('/test/round/1', '997.5412'))
 
+    def test_round_batch(self):
+        processor = Processor({
+            '/test/round/1': { 'type': 'round', 'parameters':{ 'decimals': 1}},
+            '/test/round/0': { 'type': 'round', 'parameters':{ 'decimals': 0}},
+        })
+        for topic, values in [
+            ('/test/round/1', ['0.15', '0.35', '1.45', '-2.25', '2.5', '1e20']),
+            ('/test/round/0', ['0.5', '1.5', '2.5', '-0.5', '1e20', '-1e20']),
+        ]:
+            self.assertEquals(
+                [processor.process(topic, value) for value in values],
+                processor.process_batch(topic, values)
+            )
+        self.assertEquals(10 ** 20, processor.process_batch('/test/round/0', ['1e20'])[0])
+
     def test_linear(self):
         processor = Processor({
             '/test/linear/1': { 'type': 'linear', 'parameters':{ 'slope': 2, 'offset': 1}},
@@ -67,6 +83,78 @@ class TestProcessor(unittest.TestCase):
         self.assertEquals(2, processor.process('/test/step', '3'))
         self.assertEquals(3, processor.process('/test/step', '10'))
 
+    def test_step_unsorted(self):
+        processor = Processor({
+            '/test/step': { 'type': 'step', 'parameters':{ 100: 'high', 10: 'low', 50: 'mid', 20: 'normal'}},
+        })
+        self.assertEquals('low', processor.process('/test/step', '5'))
+        self.assertEquals('normal', processor.process('/test/step', '15'))
+        self.assertEquals('mid', processor.process('/test/step', '50'))
+        self.assertEquals('high', processor.process('/test/step', '51'))
+        self.assertEquals('high', processor.process('/test/step', '1000'))
+
+    def test_interpolate(self):
+        processor = Processor({
+            '/test/interpolate': { 'type': 'interpolate', 'parameters':{ 0: 0, 100: 50, 200: 150, 300: 150}},
+        })
+        self.assertEquals(0, processor.process('/test/interpolate', '-10'))
+        self.assertEquals(25, processor.process('/test/interpolate', '50'))
+        self.assertEquals(100, processor.process('/test/interpolate', '150'))
+        self.assertEquals(150, processor.process('/test/interpolate', '250'))
+        self.assertEquals(150, processor.process('/test/interpolate', '400'))
+        self.assertEquals([0, 25, 100, 150], processor.process_batch('/test/interpolate', ['-10', '50', 150, 400]))
+
+    def test_window(self):
+        processor = Processor({
+            '/test/average': { 'type': 'average', 'parameters':{ 'samples': 3}},
+            '/test/min': { 'type': 'min', 'parameters':{ 'samples': 2}},
+            '/test/max': { 'type': 'max', 'parameters':{ 'samples': 2}},
+            '/test/median': { 'type': 'median', 'parameters':{ 'samples': 4}},
+        })
+        self.assertEquals([1, 1.5, 2, 3, 4], [processor.process('/test/average', value) for value in ['1', '2', '3', '4', '5']])
+        self.assertEquals([5, 3, 3, 4], [processor.process('/test/min', value) for value in [5, 3, 4, 8]])
+        self.assertEquals([5, 5, 4, 8], [processor.process('/test/max', value) for value in [5, 3, 4, 8]])
+        self.assertEquals([5, 4, 4, 4.5, 6], [processor.process('/test/median', value) for value in [5, 3, 4, 8, 100]])
+
+    def test_ewma(self):
+        processor = Processor({
+            '/test/ewma': { 'type': 'ewma', 'parameters':{ 'alpha': 0.5}},
+        })
+        self.assertEquals([10, 15, 12.5], [processor.process('/test/ewma', value) for value in ['10', '20', '10']])
+
+    def test_state_reload(self):
+        filters = {
+            '/test/kept': { 'type': 'average', 'parameters':{ 'samples': 2}},
+            '/test/changed': { 'type': 'average', 'parameters':{ 'samples': 2}},
+        }
+        processor = Processor(filters)
+        processor.process('/test/kept', 10)
+        processor.process('/test/changed', 10)
+        processor.load({
+            '/test/kept': { 'type': 'average', 'parameters':{ 'samples': 2}},
+            '/test/changed': { 'type': 'average', 'parameters':{ 'samples': 3}},
+        })
+        self.assertEquals(15, processor.process('/test/kept', 20))
+        self.assertEquals(20, processor.process('/test/changed', 20))
+
+    def test_deadband(self):
+        processor = Processor({
+            '/test/deadband/absolute': { 'type': 'deadband', 'parameters':{ 'absolute': 2}},
+            '/test/deadband/percent': [
+                { 'type': 'linear', 'parameters':{ 'slope': 1, 'offset': 0}},
+                { 'type': 'deadband', 'parameters':{ 'percent': 10}},
+            ],
+            '/test/deadband/heartbeat': { 'type': 'deadband', 'parameters':{ 'absolute': 2, 'heartbeat': 0.01}},
+        })
+        values = [processor.process('/test/deadband/absolute', value) for value in ['10', '11', '12', '13', '11', '10']]
+        self.assertEquals(['10', None, None, '13', None, '10'], values)
+        values = [processor.process('/test/deadband/percent', value) for value in ['100', '109', '111', '99']]
+        self.assertEquals([100, None, 111, 99], values)
+        self.assertEquals('10', processor.process('/test/deadband/heartbeat', '10'))
+        self.assertEquals(None, processor.process('/test/deadband/heartbeat', '10'))
+        time.sleep(.02)
+        self.assertEquals('10', processor.process('/test/deadband/heartbeat', '10'))
+
     def test_boolean(self):
         processor = Processor({
             '/test/boolean': { 'type': 'boolean' },
@@ -97,5 +185,98 @@ class TestProcessor(unittest.TestCase):
         })
         self.assertEquals("username|text", processor.process('/test/regexp1', 'username: text'))
 
+    def test_batch(self):
+        processor = Processor({
+            '/test/batch/chained': [
+                { 'type': 'linear', 'parameters':{ 'slope': 0.5, 'offset': 1}},
+                { 'type': 'round', 'parameters':{ 'decimals': 0}},
+            ],
+            '/test/batch/round': { 'type': 'round', 'parameters':{ 'decimals': 2}},
+            '/test/batch/boolean': { 'type': 'boolean' },
+            '/test/batch/not': { 'type': 'not' },
+            '/test/batch/step': { 'type': 'step', 'parameters':{ 2: 1, 4: 2, 5: 3}},
+            '/test/batch/enum': { 'type': 'enum', 'parameters':{ 0: 'off', 1: 'on'}},
+        })
+        self.assertEquals([7, 2, 1], processor.process_batch('/test/batch/chained', ['11', '2', '-1']))
+        self.assertEquals([997.54, -1.25], processor.process_batch('/test/batch/round', ['997.5412', -1.2451]))
+        self.assertEquals([0, 1, 1, 1], processor.process_batch('/test/batch/boolean', ['0', '1', '-1', 5]))
+        self.assertEquals([1, 0, 0, 0], processor.process_batch('/test/batch/not', ['0', '1', '-1', 5]))
+        self.assertEquals([1, 1, 2, 3], processor.process_batch('/test/batch/step', ['0', '2', '3', '10']))
+        self.assertEquals(['on', 'off'], processor.process_batch('/test/batch/enum', ['1', '0']))
+        self.assertEquals(['1', '2'], processor.process_batch('/test/batch/unknown', ('1', '2')))
+
+    def test_batch_suppressed(self):
+        processor = Processor({
+            '/test/batch/deadband': [
+                { 'type': 'deadband', 'parameters':{ 'absolute': 2}},
+                { 'type': 'linear', 'parameters':{ 'slope': 2, 'offset': 0}},
+            ],
+        })
+        values = ['10', '11', '12', '13', '11', '10']
+        self.assertEquals([20, None, None, 26, None, 20], processor.process_batch('/test/batch/deadband', values))
+        self.assertEquals([None, None], processor.process_batch('/test/batch/deadband', ['10', '11']))
+
+    def test_batch_stateless(self):
+        processor = Processor({
+            '/test/batch/stateless': [
+                { 'type': 'linear', 'parameters':{ 'slope': 2, 'offset': 0}},
+                { 'type': 'average', 'parameters':{ 'samples': 4}},
+                { 'type': 'deadband', 'parameters':{ 'absolute': 5}},
+            ],
+        })
+        self.assertEquals([20, 40, 60], processor.process_batch('/test/batch/stateless', [10, 20, 30], True))
+        # the stateful filters did not see the values
+        self.assertEquals(2, processor.process('/test/batch/stateless', 1))
+
+    def test_wildcard(self):
+        processor = Processor({
+            '/raw/xbee/+/adc-7': { 'type': 'linear', 'parameters':{ 'slope': 2, 'offset': 0}},
+            '/raw/xbee/0013a200406bfd09/adc-7': { 'type': 'linear', 'parameters':{ 'slope': 3, 'offset': 0}},
+            '/raw/xbee/0013a200407b6d06/#': { 'type': 'linear', 'parameters':{ 'slope': 4, 'offset': 0}},
+            '/raw/+/+/average': { 'type': 'average', 'parameters':{ 'samples': 2}},
+        })
+        self.assertEquals(20, processor.process('/raw/xbee/0013a2004092d70b/adc-7', '10'))
+        self.assertEquals(30, processor.process('/raw/xbee/0013a200406bfd09/adc-7', '10'))
+        self.assertEquals(40, processor.process('/raw/xbee/0013a200407b6d06/adc-7', '10'))
+        self.assertEquals(40, processor.process('/raw/xbee/0013a200407b6d06/dio-12', '10'))
+        self.assertEquals('10', processor.process('/raw/xbee/0013a2004092d70b/adc-1', '10'))
+        self.assertEquals(10, processor.process('/raw/xbee/1/average', '10'))
+        self.assertEquals(20, processor.process('/raw/xbee/2/average', '20'))
+        self.assertEquals(15, processor.process('/raw/xbee/1/average', '20'))
+
+    def test_cache(self):
+        processor = Processor({
+            '/raw/xbee/+/adc-7': { 'type': 'linear', 'parameters':{ 'slope': 2, 'offset': 0}},
+        })
+        processor.cache_size = 10
+        for i in range(100):
+            self.assertEquals('10', processor.process('/raw/xbee/%d/adc-1' % i, '10'))
+        self.assertEquals(['10'], processor.process_batch('/raw/xbee/0/adc-1', ['10']))
+        self.assertTrue(len(processor._misses) <= 10)
+        self.assertEquals([], processor._chains.keys())
+        self.assertEquals(20, processor.process('/raw/xbee/1/adc-7', '10'))
+        self.assertEquals(['/raw/xbee/1/adc-7'], processor._chains.keys())
+
+    def test_invalid(self):
+        processor = Processor({
+            '/test/invalid/1': { 'type': 'unknown' },
+            '/test/invalid/2': { 'type': 'linear', 'parameters':{ 'slope': 2}},
+            '/test/invalid/3': [
+                { 'type': 'regexp', 'parameters':{'pattern': '(', 'replacement': ''}},
+                { 'type': 'round', 'parameters':{ 'decimals': 0}},
+            ],
+        })
+        self.assertEquals(3, len(processor.errors))
+        self.assertEquals('10', processor.process('/test/invalid/1', '10'))
+        self.assertEquals('10', processor.process('/test/invalid/2', '10'))
+        self.assertEquals(10, processor.process('/test/invalid/3', '10.2'))
+
+    def test_error(self):
+        processor = Processor({
+            '/test/error': { 'type': 'linear', 'parameters':{ 'slope': 2, 'offset': 1}},
+        })
+        self.assertEquals([], processor.errors)
+        self.assertEquals('text', processor.process('/test/error', 'text'))
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,156 @@
+#! /usr/bin/python
+# -*- coding: utf-8 -*-
+
+__author__ = "Xose Pérez"
+__contact__ = "xose.perez@gmail.com"
+__copyright__ = "Copyright (C) Xose Pérez"
+__license__ = 'GPL v3'
+
+import time
+import shutil
+import tempfile
+import unittest
+
+from libs.journal import Journal
+from libs.publish_queue import PublishQueue
+
+class MessageInfo(object):
+
+    def __init__(self, rc):
+        self.rc = rc
+
+    def is_published(self):
+        return True
+
+class Client(object):
+    """
+    Broker client that fails the first publish calls
+    """
+
+    connected = True
+    qos = 0
+    retain = False
+
+    def __init__(self, failures, error=None):
+        self.failures = failures
+        self.error = error
+        self.messages = []
+        self.options = []
+
+    def publish(self, topic, value, qos=None, retain=None, properties=None):
+        if self.failures:
+            self.failures -= 1
+            if self.error:
+                raise self.error
+            return MessageInfo(4)
+        self.messages.append((topic, str(value)))
+        self.options.append((topic, retain, properties))
+        return MessageInfo(0)
+
+class TestPublishQueue(unittest.TestCase):
+
+    def drain(self, queue):
+        messages = []
+        while len(queue):
+            messages.append(queue.get(0)[:2])
+        return messages
+
+    def test_coalesce(self):
+        queue = PublishQueue(None, 10)
+        queue.put('/test/adc', 1)
+        queue.put('/test/event', 'a', False)
+        queue.put('/test/adc', 2)
+        queue.put('/test/event', 'b', False)
+        self.assertEquals(1, queue.coalesced)
+        self.assertEquals([
+            ('/test/adc', 2),
+            ('/test/event', 'a'),
+            ('/test/event', 'b'),
+        ], self.drain(queue))
+
+    def test_events(self):
+        queue = PublishQueue(None, 10)
+        queue.configure(['/test/events/#'])
+        queue.put('/test/events/door', 1)
+        queue.put('/test/events/door', 0)
+        self.assertEquals([('/test/events/door', 1), ('/test/events/door', 0)], self.drain(queue))
+
+    def test_overflow(self):
+        queue = PublishQueue(None, 2)
+        queue.put('/test/1', 1)
+        queue.put('/test/2', 2)
+        queue.put('/test/2', 3)
+        queue.put('/test/3', 4)
+        self.assertEquals(1, queue.dropped)
+        self.assertEquals([('/test/2', 3), ('/test/3', 4)], self.drain(queue))
+
+    def wait_published(self, queue, count):
+        limit = time.time() + 5
+        while queue.published < count and time.time() < limit:
+            time.sleep(.01)
+        queue.stop(0)
+
+    def test_replay_error(self):
+        path = tempfile.mkdtemp()
+        try:
+            journal = Journal(path)
+            journal.open()
+            journal.append('/test/1', '1')
+            journal.close()
+            mqtt = Client(1, ValueError('Boom'))
+            queue = PublishQueue(mqtt, 10)
+            queue.retry_interval = .01
+            queue.journal = journal
+            queue.start()
+            self.wait_published(queue, 1)
+            self.assertEquals([('/test/1', '1')], mqtt.messages)
+        finally:
+            shutil.rmtree(path)
+
+    def test_publish_failure(self):
+        mqtt = Client(2)
+        queue = PublishQueue(mqtt, 10)
+        queue.retry_interval = .01
+        queue.put('/test/1', 1, False)
+        queue.put('/test/2', 2, False)
+        queue.start()
+        self.wait_published(queue, 2)
+        self.assertEquals(2, queue.failed)
+        self.assertEquals([('/test/1', '1'), ('/test/2', '2')], mqtt.messages)
+
+    def test_replay_live(self):
+        path = tempfile.mkdtemp()
+        try:
+            journal = Journal(path)
+            journal.rate = 5
+            journal.open()
+            journal.append('/test/1', '1', 0, True, properties={'address': 'a'})
+            journal.append('/test/2', '2', 0, True)
+            journal.append('/test/3', '3', 0, True)
+            journal.close()
+            mqtt = Client(0)
+            queue = PublishQueue(mqtt, 100)
+            queue.journal = journal
+            queue.start()
+            for index in range(40):
+                queue.put('/test/live', index, False)
+            queue.put('/test/3', 'new', False)
+            # live messages do not wait for the journal replay
+            limit = time.time() + 1
+            while queue.published < 41 and time.time() < limit:
+                time.sleep(.01)
+            self.assertTrue(journal)
+            self.wait_published(queue, 44)
+            self.assertFalse(journal)
+            self.assertEquals(44, len(mqtt.messages))
+            replayed = [options for options in mqtt.options if options[0] in ['/test/1', '/test/2', '/test/3']]
+            self.assertEquals([
+                ('/test/1', True, {'address': 'a'}),
+                ('/test/2', True, None),
+                ('/test/3', False, None),
+            ], [options for options in replayed if options[1] is not None])
+        finally:
+            shutil.rmtree(path)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,54 @@
+#! /usr/bin/python
+# -*- coding: utf-8 -*-
+
+__author__ = "Xose Pérez"
+__contact__ = "xose.perez@gmail.com"
+__copyright__ = "Copyright (C) Xose Pérez"
+__license__ = 'GPL v3'
+
+import unittest
+import binascii
+
+from SerialMock import Serial
+from xbee import ZigBee
+from libs.samples import SampleDecoder
+
+class TestSamples(unittest.TestCase):
+
+    def setUp(self):
+        self.decoder = SampleDecoder()
+        self.xbee = ZigBee(Serial(None, None))
+
+    def check(self, frame):
+        frame = binascii.unhexlify(frame)
+        address, samples = self.decoder.decode(frame)
+        packet = self.xbee._split_response(frame)
+        self.assertEquals(binascii.hexlify(packet['source_addr_long']), address)
+        expected = [dict((port, int(value)) for port, value in sample.iteritems()) for sample in packet['samples']]
+        self.assertEquals(expected, [dict(sample) for sample in samples])
+        return samples
+
+    def test_digital_analog(self):
+        samples = self.check('920013a200406bfd090123010110008010000B00')
+        self.assertEquals(('dio-12', 'adc-7'), samples[0].ports)
+        self.assertEquals(2816, samples[0]['adc-7'])
+
+    def test_analog(self):
+        samples = self.check('920013a200406bfd090123010100008303ff00120B00')
+        self.assertEquals([('adc-0', 1023), ('adc-1', 18), ('adc-7', 2816)], samples[0].items())
+
+    def test_digital(self):
+        self.check('920013a200406bfd0901230101001C000004')
+
+    def test_tables(self):
+        first = self.check('920013a200406bfd090123010110008010000B00')
+        second = self.check('920013a200406bfd090123010110008000000A00')
+        self.assertTrue(first[0].ports is second[0].ports)
+        self.assertEquals(0, second[0]['dio-12'])
+
+    def test_invalid(self):
+        self.assertEquals(None, self.decoder.decode(binascii.unhexlify('920013a200406bfd0901230101100080')))
+        self.assertEquals(None, self.decoder.decode(binascii.unhexlify('900013a200406bfd09012301')))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,110 @@
+#! /usr/bin/python
+# -*- coding: utf-8 -*-
+
+__author__ = "Xose Pérez"
+__contact__ = "xose.perez@gmail.com"
+__copyright__ = "Copyright (C) Xose Pérez"
+__license__ = 'GPL v3'
+
+import unittest
+import threading
+
+from libs.scheduler import Command, CommandScheduler, wait
+
+class TestScheduler(unittest.TestCase):
+
+    def setUp(self):
+        self.sent = []
+        self.responses = []
+        self.scheduler = CommandScheduler(self.sent.append)
+
+    def callback(self, request):
+        self.responses.append((request.address, request.command, request.status_name, request.response))
+
+    def test_windows(self):
+        self.scheduler.window = 3
+        for command in ['D0', 'D1', 'D2']:
+            self.scheduler.submit('a', command)
+        self.scheduler.submit('b', 'D0')
+        self.scheduler.submit('c', 'D0')
+        self.scheduler.submit('d', 'D0')
+        # one per node, three in the network
+        self.assertEquals([('a', 'D0'), ('b', 'D0'), ('c', 'D0')], [(r.address, r.command) for r in self.sent])
+        self.assertEquals(3, len(set(r.frame_id for r in self.sent)))
+        # nodes take turns
+        self.scheduler.complete(self.sent[0].frame_id, 'D0', '\x00', '\x02')
+        self.assertEquals(('a', 'D1'), (self.sent[3].address, self.sent[3].command))
+        self.scheduler.complete(self.sent[1].frame_id, 'D0', '\x00', '\x02')
+        self.assertEquals(('d', 'D0'), (self.sent[4].address, self.sent[4].command))
+
+    def test_complete(self):
+        request = self.scheduler.submit('a', 'D0')
+        request.add_done_callback(self.callback)
+        self.assertEquals(None, self.scheduler.complete(request.frame_id + 1, 'D0', '\x00', '\x02'))
+        self.assertEquals(None, self.scheduler.complete(request.frame_id, 'D1', '\x00', '\x02'))
+        self.assertFalse(request.done())
+        self.assertEquals(request, self.scheduler.complete(request.frame_id, 'D0', '\x00', '\x02'))
+        self.assertEquals([('a', 'D0', 'OK', '\x02')], self.responses)
+        self.assertEquals(('OK', '\x02'), request.result(0))
+        self.assertTrue(request.ok)
+        self.assertTrue(request.latency >= 0)
+        self.assertEquals(0, len(self.scheduler))
+
+    def test_timeout(self):
+        self.scheduler.retries = 1
+        request = self.scheduler.submit('a', 'D0')
+        request.add_done_callback(self.callback)
+        self.scheduler.submit('a', 'D1')
+        frame_id = request.frame_id
+        self.scheduler.expire(request.deadline)
+        # retried before the next command for the node, with a new frame ID
+        self.assertEquals([request, request], self.sent)
+        self.assertNotEquals(frame_id, request.frame_id)
+        self.assertEquals(None, self.scheduler.complete(frame_id, 'D0', '\x00', '\x02'))
+        self.scheduler.expire(request.deadline)
+        self.assertEquals([('a', 'D0', 'Timeout', None)], self.responses)
+        self.assertEquals('D1', self.sent[2].command)
+        self.assertEquals(1, self.scheduler.failed)
+
+    def test_no_retries(self):
+        request = self.scheduler.submit(None, 'ND', retries=0)
+        self.scheduler.expire(request.deadline)
+        self.assertEquals(1, len(self.sent))
+        self.assertTrue(request.done())
+
+    def test_wait(self):
+        self.scheduler.window = 2
+        self.scheduler.node_window = 2
+        requests = [self.scheduler.submit('a', command) for command in ['D0', 'D1']]
+        self.scheduler.complete(requests[1].frame_id, 'D1', '\x00', '\x05')
+        self.assertEquals([requests[1]], wait(requests, 0.01))
+        self.scheduler.complete(requests[0].frame_id, 'D0', '\x00', '\x02')
+        self.assertEquals(requests, wait(requests))
+
+    def test_frame_ids(self):
+        self.scheduler.window = 300
+        for i in range(255):
+            self.scheduler.submit(str(i), 'D0')
+        self.assertEquals(range(1, 256), sorted(r.frame_id for r in self.sent))
+        self.scheduler.complete(7, 'D0', '\x00', '\x02')
+        self.scheduler.submit('x', 'D0')
+        self.assertEquals(7, self.sent[-1].frame_id)
+
+    def test_callbacks_race(self):
+        # every callback runs exactly once, whether added before or after resolving
+        for i in range(20):
+            request = Command('a', 'D0')
+            calls = []
+            threads = [
+                threading.Thread(target=request.add_done_callback, args=(calls.append, ))
+                for j in range(10)
+            ]
+            threads.insert(5, threading.Thread(target=request.resolve, args=('\x00', '\x02')))
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            self.assertEquals([request] * 10, calls)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+#! /usr/bin/python
+# -*- coding: utf-8 -*-
+
+__author__ = "Xose Pérez"
+__contact__ = "xose.perez@gmail.com"
+__copyright__ = "Copyright (C) Xose Pérez"
+__license__ = 'GPL v3'
+
+import Queue
+import unittest
+
+from libs.sharding import ShardPool
+
+def worker(index, queue, commands):
+    ShardPool.consume(queue, lambda *event: commands.put((index, ) + event))
+
+class TestSharding(unittest.TestCase):
+
+    def test_shard(self):
+        pool = ShardPool(4)
+        addresses = ['0013a2004%07x' % index for index in range(100)]
+        shards = [pool.shard(address) for address in addresses]
+        self.assertEquals(shards, [ShardPool(4).shard(address) for address in addresses])
+        self.assertEquals(set(range(4)), set(shards))
+
+    def test_consume(self):
+        pool = ShardPool(1)
+        events = []
+        def handler(kind, address, value):
+            if value == 2:
+                raise ValueError('Boom')
+            events.append((kind, address, value))
+        for value in range(5):
+            pool.dispatch('0013a200406bfd09', 'message', '0013a200406bfd09', value)
+        pool.queues[0].put(None)
+        # errors do not stop the worker, stops on the sentinel
+        ShardPool.consume(pool.queues[0], handler, timeout=.1)
+        self.assertEquals([0, 1, 3, 4], [event[2] for event in events])
+
+    def test_full(self):
+        ShardPool.queue_size = 2
+        try:
+            pool = ShardPool(1)
+        finally:
+            ShardPool.queue_size = 10000
+        for value in range(5):
+            pool.dispatch('0013a200406bfd09', 'message', value)
+        self.assertEquals(3, pool.dropped)
+
+    def test_workers(self):
+        pool = ShardPool(3)
+        pool.start(worker)
+        addresses = ['0013a2004%07x' % index for index in range(10)]
+        for value in range(20):
+            for address in addresses:
+                pool.dispatch(address, address, value)
+        pool.stop()
+        events = {}
+        while True:
+            try:
+                index, address, value = pool.commands.get(True, .5)
+            except Queue.Empty:
+                break
+            self.assertEquals(pool.shard(address), index)
+            events.setdefault(address, []).append(value)
+        # every node in order
+        self.assertEquals(dict((address, range(20)) for address in addresses), events)
+        self.assertFalse(any(process.is_alive() for process in pool.processes))
+
+if __name__ == '__main__':
+    unittest.main()
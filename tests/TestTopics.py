@@ -0,0 +1,69 @@
+#! /usr/bin/python
+# -*- coding: utf-8 -*-
+
+__author__ = "Xose Pérez"
+__contact__ = "xose.perez@gmail.com"
+__copyright__ = "Copyright (C) Xose Pérez"
+__license__ = 'GPL v3'
+
+import unittest
+
+from libs.topics import TopicTrie, TopicPattern
+
+class TestTopics(unittest.TestCase):
+
+    def test_trie(self):
+        trie = TopicTrie()
+        trie.add('/raw/xbee/+/adc-7', 'adc')
+        trie.add('/raw/xbee/0013a200406bfd09/+', 'node')
+        trie.add('/raw/#', 'raw')
+        trie.add('/raw/xbee/0013a200406bfd09/adc-7', 'exact')
+        self.assertEquals(4, len(trie))
+        self.assertEquals('exact', trie.match('/raw/xbee/0013a200406bfd09/adc-7'))
+        self.assertEquals('node', trie.match('/raw/xbee/0013a200406bfd09/adc-1'))
+        self.assertEquals('adc', trie.match('/raw/xbee/0013a200407b6d06/adc-7'))
+        self.assertEquals('raw', trie.match('/raw/xbee/0013a200407b6d06/adc-1'))
+        self.assertEquals('raw', trie.match('/raw'))
+        self.assertEquals(None, trie.match('/home/door/status'))
+        self.assertEquals('none', trie.match('/home/door/status', 'none'))
+
+    def test_invalid(self):
+        trie = TopicTrie()
+        self.assertRaises(ValueError, trie.add, '/raw/#/adc-7', 'invalid')
+        self.assertTrue(TopicTrie.is_wildcard('/raw/+/adc-7'))
+        self.assertTrue(TopicTrie.is_wildcard('#'))
+        self.assertFalse(TopicTrie.is_wildcard('/raw/xbee+/adc-7'))
+
+    def test_pattern(self):
+        pattern = TopicPattern('/raw/xbee/{address}/{port}')
+        self.assertFalse(pattern.has_item)
+        self.assertEquals('/raw/xbee/0013a200406bfd09/adc-7', pattern.format('0013a200406bfd09', 'adc-7'))
+        self.assertEquals('/raw/xbee/0013a200406bfd09/adc-7', pattern.format('0013a200406bfd09', 'adc-7'))
+
+        pattern = TopicPattern('/raw/xbee/{address}/{item}/{port}/')
+        self.assertTrue(pattern.has_item)
+        self.assertEquals('/raw/xbee/0013a200406bfd09/analog/pin-7', pattern.format('0013a200406bfd09', 'adc-7'))
+        self.assertEquals('/raw/xbee/0013a200406bfd09/digital/pin-12', pattern.format('0013a200406bfd09', 'dio-12'))
+        self.assertEquals('/raw/xbee/0013a200406bfd09/config/pin-12', pattern.format('0013a200406bfd09', 'pin-12'))
+
+    def test_parse(self):
+        pattern = TopicPattern('/raw/xbee/{address}/{port}/set')
+        self.assertEquals(('0013a200406bfd09', 'dio-12'), pattern.parse('/raw/xbee/0013a200406bfd09/dio-12/set'))
+        self.assertEquals(None, pattern.parse('/raw/xbee/0013a200406bfd09/dio-12'))
+        self.assertEquals(None, pattern.parse('/raw/xbee/0013a200406bfd09/extra/dio-12/set'))
+        self.assertEquals(None, pattern.parse('/raw/xbeeX0013a200406bfd09/dio-12/set'))
+
+        pattern = TopicPattern('/raw/xbee/{address}/{item}/{port}/set')
+        self.assertEquals(('0013a200406bfd09', 'dio-12'), pattern.parse('/raw/xbee/0013a200406bfd09/digital/pin-12/set'))
+        self.assertEquals(('0013a200406bfd09', 'adc-1'), pattern.parse('/raw/xbee/0013a200406bfd09/analog/pin-1/set'))
+        self.assertEquals(('0013a200406bfd09', 'pin-1'), pattern.parse('/raw/xbee/0013a200406bfd09/config/pin-1/set'))
+
+    def test_pattern_cache(self):
+        pattern = TopicPattern('/raw/xbee/{address}/{port}')
+        pattern.cache_size = 2
+        for port in ['adc-1', 'adc-2', 'adc-3']:
+            pattern.format('0013a200406bfd09', port)
+        self.assertEquals(1, len(pattern._cache))
+
+if __name__ == '__main__':
+    unittest.main()
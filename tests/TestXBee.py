@@ -13,15 +13,26 @@ import binascii
 from SerialMock import Serial
 from libs.xbee_wrapper import XBeeWrapper
 
+class LegacySerial(Serial):
+    """
+    pyserial before 3.0, without in_waiting
+    """
+
+    @property
+    def in_waiting(self):
+        raise AttributeError('in_waiting')
+
 class TestXBee(unittest.TestCase):
 
+    serial_class = Serial
+
     serial = None
     xbee = None
     messages = []
 
     def setUp(self):
         self.messages = []
-        self.serial = Serial(None, None)
+        self.serial = self.serial_class(None, None)
         self.xbee = XBeeWrapper()
         self.xbee.default_port_name = 'serial'
         self.xbee.serial = self.serial
@@ -69,5 +80,42 @@ class TestXBee(unittest.TestCase):
         self.assertEquals('dio-12', self.messages[0]['port'])
         self.assertEquals(1, self.messages[0]['value'])
 
+    def test_x92_samples(self):
+        self.xbee.on_samples = lambda address, values: self.messages.append((address, [dict(v) for v in values]))
+        self.serial.feed('920013a200406bfd090123010110008010000B00')  # IO Sample DIO12:1, ADC7(Supply Voltage):2816
+        self.wait()
+        self.assertEquals([('0013a200406bfd09', [{'dio-12': 1, 'adc-7': 2816}])], self.messages)
+
+    def test_x97_query(self):
+        self.xbee.send_query('0013a200406bfd09', ['dio-0', 'dio-1'])
+        # one command in flight per node
+        self.assertEquals(1, len(self.xbee.scheduler._inflight))
+        frame_id = self.xbee.scheduler._inflight.keys()[0]
+        self.serial.feed('97%02x0013a200406bfd09fffe' % frame_id + binascii.hexlify('D0') + '0002')  # D0 is 2 (ADC)
+        self.wait()
+        self.assertEquals([{'address': '0013a200406bfd09', 'port': 'pin-0', 'value': 2}], self.messages)
+        self.assertEquals(['D1'], [r.command for r in self.xbee.scheduler._inflight.values()])
+
+    def test_x97_set(self):
+        request = self.xbee.send_message('0013a200406bfd09', 'dio-1', '1', False)
+        self.assertEquals(None, self.xbee.send_message('0013a200406bfd09', 'serial', '1'))
+        self.serial.feed('97%02x0013a200406bfd09fffe' % request.frame_id + binascii.hexlify('D1') + '00')
+        self.wait()
+        self.assertEquals(('OK', None), request.result(1))
+        self.assertEquals([{'address': '0013a200406bfd09', 'port': 'pin-1', 'value': 5}], self.messages)
+
+class TestXBeeNative(TestXBee):
+
+    def setUp(self):
+        XBeeWrapper.native_decoder = True
+        try:
+            TestXBee.setUp(self)
+        finally:
+            XBeeWrapper.native_decoder = False
+
+class TestXBeeNativeLegacy(TestXBeeNative):
+
+    serial_class = LegacySerial
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,316 @@
+#! /usr/bin/python
+# -*- coding: utf-8 -*-
+
+__author__ = "Xose Pérez"
+__contact__ = "xose.perez@gmail.com"
+__copyright__ = "Copyright (C) Xose Pérez"
+__license__ = 'GPL v3'
+
+import os
+import json
+import shutil
+import tempfile
+import unittest
+
+from libs.downsampler import Downsampler
+from libs.duplicates import DuplicateStore
+from libs.payloads import PayloadEncoder
+from libs.processor import Processor
+from libs.publish_queue import PublishQueue
+from libs.scheduler import Command
+from xbee2mqtt import Xbee2MQTT, radio_settings
+from TestMosquittoWrapper import Client
+
+class MQTT(object):
+    """
+    Records what the gateway sends to the broker
+    """
+
+    host = 'localhost'
+    port = 1883
+    username = None
+    password = None
+    keepalive = 60
+    qos = 0
+    retain = True
+
+    def __init__(self):
+        self.published = []
+        self.subscribed = []
+        self.unsubscribed = []
+        self.restarts = 0
+
+    def restart(self):
+        self.restarts += 1
+
+    def publish(self, topic, value, qos=None, retain=None, properties=None):
+        self.published.append((topic, value))
+
+    def subscribe(self, topics):
+        self.subscribed.append(topics)
+
+    def unsubscribe(self, topics):
+        self.unsubscribed.append(topics)
+
+class Broker(Client):
+    """
+    MQTT wrapper recording the control packets it would send
+    """
+
+    def publish(self, topic, value, qos=None, retain=None, properties=None):
+        pass
+
+class Radio(object):
+    """
+    Radio wrapper recording the messages sent through it
+    """
+
+    def __init__(self):
+        self.requests = []
+        self.queries = []
+
+    def send_message(self, address, port, value):
+        request = Command(address, 'D%s' % port[4:], value)
+        self.requests.append(request)
+        return request
+
+    def send_query(self, address):
+        self.queries.append(address)
+
+class Config(object):
+
+    def __init__(self, config):
+        self.config = config
+
+    def get(self, section, key=None, default=None):
+        return self.config.get(section, default)
+
+class TestXbee2MQTT(unittest.TestCase):
+
+    def gateway(self, routes=None, filters=None, mqtt=None):
+        gateway = Xbee2MQTT('/tmp/xbee2mqtt-test.pid')
+        gateway.mqtt = mqtt or MQTT()
+        gateway.processor = Processor(filters or {})
+        gateway.duplicates = DuplicateStore(5)
+        gateway.default_topic_pattern = '/raw/xbee/{address}/{port}'
+        gateway.default_input_topic_pattern = '/raw/xbee/{address}/{port}/set'
+        gateway.expose_undefined_topics = True
+        gateway._owners = {}
+        gateway._patterns = {}
+        gateway.load(routes or {})
+        return gateway
+
+    def test_port_topic(self):
+        gateway = self.gateway({'0013a200406bfd09': {'adc-7': '/home/power'}})
+        self.assertEquals('/home/power', gateway.port_topic('0013a200406bfd09', 'adc-7'))
+        self.assertEquals('/raw/xbee/0013a200406bfd09/adc-1', gateway.port_topic('0013a200406bfd09', 'adc-1'))
+        gateway.expose_undefined_topics = False
+        self.assertEquals('/home/power', gateway.port_topic('0013a200406bfd09', 'adc-7'))
+        self.assertEquals(False, gateway.port_topic('0013a200406bfd09', 'adc-1'))
+
+    def test_expose_port(self):
+        mqtt = Broker('test')
+        mqtt.connected = True
+        gateway = self.gateway(mqtt=mqtt)
+        address = '0013a200406bfd09'
+        gateway.xbee_on_message(address, 'pin-3', 4)
+        mqtt.loop(0)
+        self.assertEquals([
+            ('subscribe', ['/raw/xbee/%s/dio-3/set' % address, '/raw/xbee/%s/pin-3/set' % address]),
+        ], mqtt.requests)
+        # repeated samples do not send any control packet
+        for value in [0, 1, 1, 0]:
+            gateway.xbee_on_message(address, 'dio-3', value)
+            gateway.xbee_on_message(address, 'pin-3', 4)
+            mqtt.loop(0)
+        self.assertEquals(1, len(mqtt.requests))
+        # an input pin stops listening to its output topic
+        gateway.xbee_on_message(address, 'pin-3', 3)
+        gateway.xbee_on_message(address, 'dio-3', 1)
+        mqtt.loop(0)
+        self.assertEquals(('unsubscribe', ['/raw/xbee/%s/dio-3/set' % address]), mqtt.requests[1])
+        self.assertEquals(2, len(mqtt.requests))
+
+    def test_summary(self):
+        topic = '/raw/xbee/0013a200406bfd09/adc-7'
+        gateway = self.gateway(filters={
+            topic: [
+                { 'type': 'linear', 'parameters':{ 'slope': 2, 'offset': 0}},
+                { 'type': 'average', 'parameters':{ 'samples': 4}},
+                { 'type': 'deadband', 'parameters':{ 'absolute': 5}},
+            ],
+        })
+        gateway.publish_summary('0013a200406bfd09', 'adc-7', {'last': 20, 'mean': 20.0, 'min': 10, 'max': 30, 'count': 3})
+        self.assertEquals(topic, gateway.mqtt.published[0][0])
+        self.assertEquals(
+            {'last': 40, 'mean': 40, 'min': 20, 'max': 60, 'count': 3},
+            json.loads(gateway.mqtt.published[0][1])
+        )
+        # the average window only holds samples
+        gateway.publish_sample('0013a200406bfd09', 'adc-7', 5)
+        self.assertEquals((topic, 10.0), gateway.mqtt.published[1])
+
+    def test_stateful_duplicates(self):
+        topic = '/raw/xbee/0013a200406bfd09/adc-7'
+        gateway = self.gateway(filters={
+            topic: { 'type': 'average', 'parameters':{ 'samples': 5}},
+        })
+        for value in [10, 10, 10, 10, 20]:
+            gateway.publish_sample('0013a200406bfd09', 'adc-7', value)
+        # repeated samples reach the filter, repeated averages are not published
+        self.assertEquals([(topic, 10.0), (topic, 12.0)], gateway.mqtt.published)
+
+    def test_node_duplicates(self):
+        gateway = self.gateway(filters={
+            '/raw/xbee/0013a200406bfd09/adc-7': { 'type': 'average', 'parameters':{ 'samples': 2}},
+        })
+        gateway.node_topic_pattern = '/raw/xbee/{address}'
+        for fields in [{'adc-7': 10}, {'adc-7': 10}, {'adc-7': 20}]:
+            gateway.publish_node('0013a200406bfd09', fields)
+        documents = [json.loads(value) for topic, value in gateway.mqtt.published]
+        self.assertEquals([10.0, 15.0], [document['adc-7'] for document in documents])
+
+    def test_samples_batch(self):
+        gateway = self.gateway(filters={
+            '/raw/xbee/0013a200406bfd09/adc-7': [
+                { 'type': 'linear', 'parameters':{ 'slope': 2, 'offset': 0}},
+                { 'type': 'deadband', 'parameters':{ 'absolute': 5}},
+            ],
+        })
+        gateway.xbee_on_samples('0013a200406bfd09', [
+            {'adc-7': 10, 'dio-3': 1},
+            {'adc-7': 11, 'dio-3': 0},
+            {'adc-7': 14, 'dio-3': 0},
+        ])
+        published = gateway.mqtt.published
+        self.assertEquals(
+            [('/raw/xbee/0013a200406bfd09/adc-7', 20.0), ('/raw/xbee/0013a200406bfd09/adc-7', 28.0)],
+            [message for message in published if message[0].endswith('adc-7')]
+        )
+        self.assertEquals(
+            [('/raw/xbee/0013a200406bfd09/dio-3', 1), ('/raw/xbee/0013a200406bfd09/dio-3', 0)],
+            [message for message in published if message[0].endswith('dio-3')]
+        )
+
+    def test_queue(self):
+        gateway = self.gateway()
+        gateway.queue = PublishQueue(gateway.mqtt)
+        # an empty queue is still used
+        gateway.publish_sample('0013a200406bfd09', 'adc-7', 10)
+        self.assertEquals(1, len(gateway.queue))
+        self.assertEquals([], gateway.mqtt.published)
+
+    def radios(self):
+        gateway = self.gateway()
+        radios = [Radio(), Radio()]
+        gateway.radios = radios
+        for radio in radios:
+            gateway.attach(radio)
+        return gateway, radios
+
+    def test_radio_owner(self):
+        gateway, radios = self.radios()
+        radios[1].on_message('0013a200406bfd09', 'adc-7', 10)
+        radios[0].on_identification('0013a2004092d70b', 'KITCHEN')
+        self.assertEquals(radios[1], gateway._owners['0013a200406bfd09'])
+        self.assertEquals(radios[0], gateway._owners['0013a2004092d70b'])
+        self.assertEquals(['0013a2004092d70b'], radios[0].queries)
+        self.assertEquals([], radios[1].queries)
+
+        gateway.mqtt_on_message('/raw/xbee/0013a200406bfd09/dio-3/set', '5')
+        self.assertEquals([], radios[0].requests)
+        self.assertEquals(1, len(radios[1].requests))
+        radios[1].requests[0].resolve('\x04', None)
+        topic, ack = gateway.mqtt.published[-1]
+        self.assertEquals('/raw/xbee/0013a200406bfd09/dio-3/ack', topic)
+        self.assertEquals(('5', 'Tx Failure'), (ack['value'], ack['status']))
+
+    def test_radio_unknown(self):
+        gateway, radios = self.radios()
+        gateway.mqtt_on_message('/raw/xbee/0013a200406bfd09/dio-3/set', '4')
+        # sent through every radio, only the one that reached the node acknowledges
+        self.assertEquals([1, 1], [len(radio.requests) for radio in radios])
+        radios[0].requests[0].resolve('\x04', None)
+        radios[1].requests[0].resolve('\x00', None)
+        acks = [message for message in gateway.mqtt.published if message[0].endswith('/ack')]
+        self.assertEquals(1, len(acks))
+        self.assertEquals('OK', acks[0][1]['status'])
+
+    def test_radio_settings(self):
+        settings = radio_settings(Config({
+            'radio': {'baudrate': 115200, 'escaped': True},
+            'radios': [{'port': '/dev/ttyUSB0'}, {'port': '/dev/ttyUSB1', 'escaped': False}],
+        }))
+        self.assertEquals([
+            {'port': '/dev/ttyUSB0', 'baudrate': 115200, 'escaped': True},
+            {'port': '/dev/ttyUSB1', 'baudrate': 115200, 'escaped': False},
+        ], settings)
+        self.assertEquals([{'port': '/dev/ttyAMA0'}], radio_settings(Config({'radio': {'port': '/dev/ttyAMA0'}})))
+
+    def test_reload(self):
+        path = tempfile.mkdtemp()
+        try:
+            gateway = self.gateway()
+            gateway.downsampler = Downsampler()
+            gateway.payloads = PayloadEncoder()
+            gateway.queue = PublishQueue(gateway.mqtt)
+            gateway.config_file = os.path.join(path, 'xbee2mqtt.yaml')
+            config = {
+                'general': {
+                    'routes': {
+                        '0013a200406bfd09': {'adc-7': '/home/power', 'dio-3': '/home/door'},
+                    },
+                },
+                'processor': {
+                    'filters': {
+                        '/home/power': {'type': 'average', 'parameters': {'samples': 2}},
+                        '/home/light': {'type': 'average', 'parameters': {'samples': 2}},
+                    },
+                },
+            }
+            self.reload(gateway, config)
+            self.assertEquals([['/home/door/set', '/home/power/set']], [sorted(topics) for topics in gateway.mqtt.subscribed])
+            self.assertEquals([], gateway.mqtt.unsubscribed)
+            self.assertEquals(0, gateway.mqtt.restarts)
+            gateway.processor.process('/home/power', 10)
+            gateway.processor.process('/home/light', 10)
+
+            config['general']['routes']['0013a200406bfd09'] = {'adc-7': '/home/power', 'dio-4': '/home/window'}
+            config['processor']['filters']['/home/light'] = {'type': 'average', 'parameters': {'samples': 3}}
+            config['downsample'] = {'period': 60}
+            config['payloads'] = {'codec': 'json'}
+            config['queue'] = {'size': 50, 'events': ['/home/window']}
+            config['mqtt'] = {'host': 'broker', 'qos': 1}
+            self.reload(gateway, config)
+            # only what changed
+            self.assertEquals([['/home/window/set']], gateway.mqtt.subscribed[1:])
+            self.assertEquals([['/home/door/set']], gateway.mqtt.unsubscribed)
+            self.assertEquals(('0013a200406bfd09', 'dio-4'), gateway._actions['/home/window/set'])
+            self.assertFalse('/home/door/set' in gateway._actions)
+            # unchanged filters keep their state
+            self.assertEquals(15, gateway.processor.process('/home/power', 20))
+            self.assertEquals(20, gateway.processor.process('/home/light', 20))
+            self.assertEquals(60, gateway.downsampler.period)
+            self.assertEquals('json', gateway.payloads.codec.name)
+            self.assertEquals(50, gateway.queue.size)
+            self.assertTrue(gateway.queue.events.match('/home/window', False))
+            self.assertEquals(1, gateway.mqtt.qos)
+            self.assertEquals('broker', gateway.mqtt.host)
+            self.assertEquals(1, gateway.mqtt.restarts)
+
+            # nothing changed, nothing sent
+            self.reload(gateway, config)
+            self.assertEquals(2, len(gateway.mqtt.subscribed))
+            self.assertEquals(1, len(gateway.mqtt.unsubscribed))
+            self.assertEquals(1, gateway.mqtt.restarts)
+        finally:
+            shutil.rmtree(path)
+
+    def reload(self, gateway, config):
+        handler = open(gateway.config_file, 'w')
+        handler.write(json.dumps(config))
+        handler.close()
+        gateway.do_reload()
+
+if __name__ == '__main__':
+    unittest.main()
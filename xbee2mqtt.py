@@ -26,19 +26,28 @@ __copyright__ = "Copyright (C) 2012-2013 Xose Pérez"
 __license__ = 'GPL v3'
 
 import os
-import re
 import sys
 import time
+import json
+import signal
 import logging
+import threading
 
 #from tests.SerialMock import Serial
-from parse import parse
 from serial import Serial
 from serial import SerialException
 from libs.daemon import Daemon
+from libs.downsampler import Downsampler
+from libs.journal import Journal
+from libs.duplicates import DuplicateStore
 from libs.processor import Processor
+from libs.publish_queue import PublishQueue
+from libs.payloads import PayloadEncoder
+from libs.sharding import ShardPool
+from libs.topics import TopicPattern
 from libs.config import Config
 from libs.mosquitto_wrapper import MosquittoWrapper
+from paho.mqtt.client import MQTTv5, MQTTv311
 from libs.xbee_wrapper import XBeeWrapper
 
 class Xbee2MQTT(Daemon):
@@ -47,28 +56,45 @@ class Xbee2MQTT(Daemon):
     Glues the different components together
     """
 
-    duplicate_check_window = 5
-
     logger = None
-    xbee = None
+    radios = []
     mqtt = None
     processor = None
+    downsampler = None
+    duplicates = None
+    queue = None
+    payloads = None
     config_file = None
 
+    # number of worker processes, 0 processes everything in the main process
+    workers = 0
+    shards = None
+    commands = None
+    subscribe_actions = True
+
+    # publishes the result of messages to radios to the action topic ending in /ack
+    acknowledge_actions = True
+
+    # publishes the IO samples of a frame as one JSON document to this topic
+    node_topic_pattern = None
+
     _routes = {}
     _actions = {}
-    _topics = {}
+    _owners = {}
+    _patterns = {}
 
     def load(self, routes):
         """
-        Read configuration and store bidirectional dicts
+        Read configuration and store bidirectional dicts,
+        the new dicts replace the current ones in one go
         """
-        self._routes = {}
-        self._actions = {}
+        _routes = {}
+        _actions = {}
         for address, ports in routes.iteritems():
             for port, topic in ports.iteritems():
-                self._routes[(address, port)] = topic
-                self._actions['%s/set' % topic] = (address, port)
+                _routes[(address, port)] = topic
+                _actions['%s/set' % topic] = (address, port)
+        self._routes, self._actions = _routes, _actions
 
     def log(self, level, message):
         if self.logger:
@@ -78,7 +104,14 @@ class Xbee2MQTT(Daemon):
         """
         Clean up connections and unbind ports
         """
-        self.xbee.disconnect()
+        for radio in self.radios:
+            radio.disconnect()
+        if self.shards:
+            self.shards.stop()
+        if self.downsampler:
+            self.downsampler.flush(force=True)
+        if self.queue is not None:
+            self.queue.stop()
         self.log(logging.INFO, "Exiting")
         self.mqtt.disconnect()
         sys.exit()
@@ -92,96 +125,253 @@ class Xbee2MQTT(Daemon):
 
         data = self._actions.get(topic, None)
         if data is None:
-            result = parse(self.default_input_topic_pattern, topic).named
-
-            new_schema = re.search('{item}', self.default_topic_pattern)
-            if new_schema:
-                number = result['port'][4:]
-                item = result['item']
-
-                if item == 'analog':
-                    result['port'] = 'adc-%s' % number
-                elif item == 'digital':
-                    result['port'] = 'dio-%s' % number
-                elif item == 'config':
-                    result['port'] = 'pin-%s' % number
-
-            data = (result['address'], result['port'])
+            data = self.topic_pattern(self.default_input_topic_pattern).parse(topic)
+            if data is None:
+                self.log(logging.DEBUG, "Ignoring message from unknown topic %s" % topic)
 
         if data:
             address, port = data
             self.log(logging.INFO, "Setting radio %s port %s to %s" % (address, port, message))
+            self.xbee_send_message(address, port, message, topic)
+
+    def xbee_send_message(self, address, port, value, topic=None):
+        """
+        Sends a message through the radio the address was last heard from,
+        or through every radio if the address is unknown.
+        The result is acknowledged on the topic the message came from.
+        """
+        if self.commands:
+            self.commands.put((address, port, value, topic))
+            return
+        owner = self._owners.get(address, None)
+        for radio in [owner] if owner else self.radios:
             try:
-                self.xbee.send_message(address, port, message)
+                request = radio.send_message(address, port, value)
             except Exception as e:
-                self.log(logging.ERROR, "Error while sending message (%e)" % e)
+                self.log(logging.ERROR, "Error while sending message (%s)" % e)
+                continue
+            if request and topic and self.acknowledge_actions:
+                request.add_done_callback(self.ack_callback(address, value, topic, owner is None))
 
-    def mqtt_publish(self, topic, value):
+    def ack_callback(self, address, value, topic, only_ok=False):
         """
-        Publishes a non duplicate value to a given topic
+        Returns the callback that acknowledges a pin change,
+        only_ok skips failures, for changes sent through every radio
         """
-        if topic:
+        def ack(request):
+            if only_ok and not request.ok:
+                return
+            self.xbee_on_ack(address, topic, {
+                'value': value,
+                'status': request.status_name,
+                'latency': round(request.latency, 3),
+            })
+        return ack
+
+    def xbee_on_ack(self, address, topic, ack):
+        """
+        Publishes the acknowledgement of a message to a radio,
+        to the topic the message came from ending in /ack instead of /set
+        """
+        topic = topic[:-4] if topic.endswith('/set') else topic
+        topic = '%s/ack' % topic
+        if self.shards:
+            self.shards.dispatch(address, 'ack', address, topic, ack)
+        else:
+            self.mqtt_send(topic, ack, False, address)
 
-            now = time.time()
-            if topic in self._topics.keys() \
-                and self._topics[topic]['time'] + self.duplicate_check_window > now \
-                and self._topics[topic]['value'] == value \
-                :
-                    self.log(logging.DEBUG, "Duplicate removed")
-                    return
-            self._topics[topic] = {'time': now, 'value': value}
+    def mqtt_publish(self, topic, value, coalesce=False, address=None):
+        """
+        Publishes a non duplicate value to a given topic,
+        values that can be coalesced might be replaced by a newer one while queued.
+        Every sample goes through the filters, so stateful ones see them all,
+        duplicates are checked on the processed value.
+        """
+        if topic:
 
             value = self.processor.process(topic, value)
-            self.log(logging.INFO, "Sending message to MQTT broker: %s %s" % (topic, value))
-            self.mqtt.publish(topic, value)
+            if value is None:
+                self.log(logging.DEBUG, "Value for %s suppressed by processor" % topic)
+                return
+
+            if self.duplicates.is_duplicate(topic, value):
+                self.log(logging.DEBUG, "Duplicate removed")
+                return
+
+            self.mqtt_send(topic, value, coalesce, address)
+
+    def mqtt_send(self, topic, value, coalesce=False, address=None):
+        """
+        Encodes and sends a value to the broker, through the queue if there is one.
+        The source address and the time are sent as properties.
+        """
+        self.log(logging.INFO, "Sending message to MQTT broker: %s %s" % (topic, value))
+        if self.payloads:
+            value = self.payloads.encode(topic, value)
+        properties = {'address': address, 'timestamp': '%.3f' % time.time()} if address else None
+        if self.queue is not None:
+            self.queue.put(topic, value, coalesce, properties)
+        else:
+            self.mqtt.publish(topic, value, properties=properties)
+
+    def topic_pattern(self, pattern):
+        """
+        Returns the analysed topic pattern object for a pattern string
+        """
+        topic_pattern = self._patterns.get(pattern, None)
+        if topic_pattern is None:
+            topic_pattern = self._patterns[pattern] = TopicPattern(pattern)
+        return topic_pattern
 
     def transform_pattern(self, pattern, address, port):
         """
         Transform default topic pattern to expand adc/dio ports if there is a {item} whitin
         to keep compatibility with old topic patterns schemas.
         """
-        prefix = port[:4]
-        if prefix == 'adc-':
-            item = 'analog'
-        elif prefix == 'dio-':
-            item = 'digital'
-        elif prefix == 'pin-':
-            item = 'config'
-        else:
-            item = ''
+        return self.topic_pattern(pattern).format(address, port)
 
-        new_schema = re.search('{item}', pattern)
-        if new_schema:
-            number = port[4:]
-            port = "pin-%s" % number if len(item)>0 else port
-            topic = pattern.format(address=address, port=port, item=item)
-        else:
-            topic = self.pattern.format(address=address, port=port)
-
-        # Clean excess slashes.
-        return re.sub('//+|/$', '', topic).rstrip('/')
+    def port_topic(self, address, port):
+        """
+        Returns the topic of a radio port, the route if defined
+        or the default topic if undefined topics are exposed, False otherwise
+        """
+        topic = self._routes.get((address, port), None)
+        if topic is not None:
+            return topic
+        if self.expose_undefined_topics:
+            return self.transform_pattern(self.default_topic_pattern, address, port)
+        return False
 
     def xbee_on_message(self, address, port, value):
         """
         Message from the radio coordinator
         """
         self.log(logging.DEBUG, "Message received from radio: %s %s %s" % (address, port, value))
+        self.expose_port(address, port, value)
+        if self.downsampler and self.downsampler.add(address, port, value):
+            return
+        self.publish_sample(address, port, value)
 
-        topic = self._routes.get(
-            (address, port),
-            self.transform_pattern(self.default_topic_pattern, address, port) if self.expose_undefined_topics else False
-        )
+    def xbee_on_samples(self, address, samples):
+        """
+        IO samples in a frame from the radio coordinator,
+        published as one document per sample if there is a node topic pattern,
+        otherwise the values of every port go through its filters as a batch
+        """
+        if not self.node_topic_pattern:
+            ports = {}
+            for sample in samples:
+                self.log(logging.DEBUG, "Samples received from radio: %s %s" % (address, sample))
+                for port, value in sample.iteritems():
+                    self.expose_port(address, port, value)
+                    if self.downsampler and self.downsampler.add(address, port, value):
+                        continue
+                    ports.setdefault(port, []).append(value)
+            for port, values in ports.iteritems():
+                self.publish_samples(address, port, values)
+            return
+
+        for sample in samples:
+            self.log(logging.DEBUG, "Samples received from radio: %s %s" % (address, sample))
+            fields = {}
+            for port, value in sample.iteritems():
+                self.expose_port(address, port, value)
+                if self.downsampler and self.downsampler.add(address, port, value):
+                    continue
+                fields[port] = value
+            self.publish_node(address, fields)
+
+    def expose_port(self, address, port, value):
+        """
+        Subscribes to the input topics of undefined digital ports,
+        output topics are only listened to while the pin is configured as an output.
+        Only pin configuration samples change the output subscription, so repeated
+        samples leave the desired subscriptions as they are.
+        """
         prefix = port[:4]
-        if self.expose_undefined_topics and prefix in ['dio-', 'pin-']:
-            self.mqtt.subscribe(self.transform_pattern(self.default_input_topic_pattern, address, port))
-            number = port[4:]
-            digital = 'dio-%s' % number
-            digital_topic = self.transform_pattern(self.default_input_topic_pattern, address, digital)
-            if prefix == 'pin-' and value in [4, 5]:
-                self.mqtt.subscribe(digital_topic)
-            else:
-                self.mqtt.unsubscribe(digital_topic)
-        self.mqtt_publish(topic, value)
+        if not self.expose_undefined_topics or prefix != 'pin-':
+            return
+        self.mqtt.subscribe(self.transform_pattern(self.default_input_topic_pattern, address, port))
+        digital_topic = self.transform_pattern(self.default_input_topic_pattern, address, 'dio-%s' % port[4:])
+        if value in [4, 5]:
+            self.mqtt.subscribe(digital_topic)
+        else:
+            self.mqtt.unsubscribe(digital_topic)
+
+    def publish_sample(self, address, port, value):
+        """
+        Publishes a sample from a radio port to its topic
+        """
+        topic = self.port_topic(address, port)
+        # analog samples are telemetry, only the latest value matters,
+        # digital state changes are events
+        self.mqtt_publish(topic, value, port[:4] == 'adc-', address)
+
+    def publish_samples(self, address, port, values):
+        """
+        Publishes the samples of a radio port in a frame to its topic,
+        the filters evaluate them all at once
+        """
+        topic = self.port_topic(address, port)
+        if not topic:
+            return
+        for value in self.processor.process_batch(topic, values):
+            if value is None:
+                self.log(logging.DEBUG, "Value for %s suppressed by processor" % topic)
+                continue
+            if self.duplicates.is_duplicate(topic, value):
+                self.log(logging.DEBUG, "Duplicate removed")
+                continue
+            self.mqtt_send(topic, value, port[:4] == 'adc-', address)
+
+    def publish_summary(self, address, port, value):
+        """
+        Publishes the summary of a downsampling bucket to the port topic.
+        The statistics of a summary document only go through the stateless
+        port filters, they are not samples, the sample count is left as is.
+        """
+        if not isinstance(value, dict):
+            self.publish_sample(address, port, value)
+            return
+
+        topic = self.port_topic(address, port)
+        if not topic:
+            return
+        names = ['last', 'mean', 'min', 'max']
+        values = self.processor.process_batch(topic, [value[name] for name in names], True)
+        document = dict((name, processed) for name, processed in zip(names, values) if processed is not None)
+        if not document:
+            self.log(logging.DEBUG, "Summary for %s suppressed by processor" % topic)
+            return
+        document['count'] = value['count']
+        self.mqtt_send(topic, document if self.payloads else json.dumps(document, sort_keys=True), port[:4] == 'adc-', address)
+
+    def publish_node(self, address, fields):
+        """
+        Publishes the values of a node as a JSON document to the node topic.
+        Every field goes through the filters of its port topic,
+        ports without a topic are left out.
+        """
+        topic = self.transform_pattern(self.node_topic_pattern, address, '')
+        if not topic or not fields:
+            return
+
+        document = {}
+        for port, value in fields.iteritems():
+            field_topic = self.port_topic(address, port)
+            if not field_topic:
+                continue
+            value = self.processor.process(field_topic, value)
+            if value is not None:
+                document[port] = value
+        if not document:
+            return
+        if self.duplicates.is_duplicate(topic, sorted(document.items())):
+            self.log(logging.DEBUG, "Duplicate removed")
+            return
+        document['ts'] = round(time.time(), 3)
+        # a node document is a snapshot, only the latest matters
+        self.mqtt_send(topic, document if self.payloads else json.dumps(document, sort_keys=True), True, address)
 
     def xbee_on_identification(self, address, alias):
         """
@@ -190,52 +380,210 @@ class Xbee2MQTT(Daemon):
         now = time.strftime("%s")
         self.log(logging.INFO, "Identification received from radio: %s (%s) %s" % (address, alias, now))
 
-        topic = self._routes.get(
-            (address, "seen"),
-            self.transform_pattern(self.default_topic_pattern, address, "seen") if self.expose_undefined_topics else False
-        )
-        self.mqtt_publish(topic, now)
+        topic = self.port_topic(address, "seen")
+        self.mqtt_publish(topic, now, address=address)
+
+        topic = self.port_topic(address, "alias")
+        self.mqtt_publish(topic, alias, address=address)
+
+        radio = self._owners.get(address, None)
+        if radio:
+            radio.send_query(address)
+
+    def attach(self, radio):
+        """
+        Binds the radio hooks, remembering which radio every address is heard from
+        """
+        def on_message(address, port, value):
+            self._owners[address] = radio
+            if self.shards:
+                self.shards.dispatch(address, 'message', address, port, value)
+            else:
+                self.xbee_on_message(address, port, value)
+
+        def on_samples(address, samples):
+            self._owners[address] = radio
+            if self.shards:
+                self.shards.dispatch(address, 'samples', address, samples)
+            else:
+                self.xbee_on_samples(address, samples)
+
+        def on_identification(address, alias):
+            self._owners[address] = radio
+            if self.shards:
+                self.shards.dispatch(address, 'identification', address, alias)
+                radio.send_query(address)
+            else:
+                self.xbee_on_identification(address, alias)
 
-        topic = self._routes.get(
-            (address, "alias"),
-            self.transform_pattern(self.default_topic_pattern, address, "alias") if self.expose_undefined_topics else False
-        )
-        self.mqtt_publish(topic, alias)
-        self.xbee.send_query(address)
+        radio.on_message = on_message
+        radio.on_samples = on_samples
+        radio.on_identification = on_identification
+        radio.on_node_discovery = on_identification
+        radio.logger = self.logger
+
+    def handle_event(self, kind, *args):
+        """
+        Event dispatched from the ingest process to a worker
+        """
+        if kind == 'message':
+            self.xbee_on_message(*args)
+        elif kind == 'ack':
+            address, topic, ack = args
+            self.mqtt_send(topic, ack, False, address)
+        elif kind == 'samples':
+            self.xbee_on_samples(*args)
+        elif kind == 'identification':
+            self.xbee_on_identification(*args)
 
     def do_reload(self):
+        """
+        Reloads the configuration applying only what changed:
+        routes, action subscriptions, filters, downsampling and MQTT settings
+        """
         self.log(logging.INFO, "Reloading")
-        config = Config(config_file)
+        if self.shards:
+            for process in self.shards.processes:
+                os.kill(process.pid, signal.SIGUSR1)
+            return
+
+        try:
+            config = Config(self.config_file)
+        except Exception as e:
+            self.log(logging.ERROR, "Could not read configuration file %s (%s)" % (self.config_file, e))
+            return
+
+        routes, actions = self._routes, self._actions
         self.load(config.get('general', 'routes', {}))
-        self.mqtt.subscribe(self._actions.keys())
+        changed = [key for key in set(routes) | set(self._routes) if routes.get(key) != self._routes.get(key)]
+        self.log(logging.INFO, "Routes reloaded, %d changed" % len(changed))
+        self.node_topic_pattern = config.get('general', 'node_topic_pattern', None)
+
+        if self.subscribe_actions:
+            removed = [topic for topic in actions if topic not in self._actions]
+            added = [topic for topic in self._actions if topic not in actions]
+            if removed:
+                self.mqtt.unsubscribe(removed)
+            if added:
+                self.mqtt.subscribe(added)
+            self.mqtt.subscribe_to = self._actions.keys()
+
+        self.processor.load(config.get('processor', 'filters', {}))
+
+        if self.downsampler:
+            self.downsampler.configure(config.get('downsample'))
+        if self.payloads:
+            self.payloads.configure(config.get('payloads'))
+        if self.queue is not None:
+            self.queue.size = config.get('queue', 'size', self.queue.size)
+            self.queue.configure(config.get('queue', 'events', []))
+        self.duplicates.window = config.get('general', 'duplicate_check_window', self.duplicates.window)
+        self.duplicates.size = config.get('general', 'duplicate_check_size', self.duplicates.size)
+
+        settings = config.get('mqtt') or {}
+        self.mqtt.qos = settings.get('qos', self.mqtt.qos)
+        self.mqtt.retain = settings.get('retain', self.mqtt.retain)
+        reconnect = False
+        for key in ['host', 'port', 'username', 'password', 'keepalive']:
+            if key in settings and settings[key] != getattr(self.mqtt, key):
+                setattr(self.mqtt, key, settings[key])
+                reconnect = True
+        if reconnect:
+            self.log(logging.INFO, "MQTT connection settings changed")
+            self.mqtt.restart()
+
+    def setup(self):
+        """
+        Binds the publishing side and connects to the MQTT broker
+        """
+        self.mqtt.on_message_cleaned = self.mqtt_on_message
+        self.mqtt.subscribe_to = self._actions.keys() if self.subscribe_actions else []
+        self.mqtt.logger = self.logger
+        if self.downsampler:
+            self.downsampler.on_summary = self.publish_summary
+            self.downsampler.logger = self.logger
+        if self.queue is not None:
+            self.queue.logger = self.logger
+            self.queue.start()
+        self.mqtt.connect()
+
+    def run_worker(self, index, queue, commands):
+        """
+        Entry point of a worker process in sharded mode,
+        routes, filters and publishes the events of the nodes it owns
+        and forwards commands for the radios to the ingest process
+        """
+        self.shards = None
+        self.commands = commands
+        # only one worker handles the configured actions
+        self.subscribe_actions = index == 0
+        self.mqtt.reinitialise('%s-%d' % (self.mqtt._client_id, index))
+        if self.queue is not None and self.queue.journal is not None:
+            self.queue.journal.path = os.path.join(self.queue.journal.path, str(index))
+        self.setup()
+        thread = threading.Thread(target=self.loop, name='mqtt')
+        thread.daemon = True
+        thread.start()
+        ShardPool.consume(queue, self.handle_event)
+        self.mqtt.disconnect()
 
     def run(self):
         """
         Entry point, initiates components and loops forever...
         """
         self.log(logging.INFO, "Starting " + __app__ + " v" + __version__)
-        self.mqtt.on_message_cleaned = self.mqtt_on_message
-        self.mqtt.subscribe_to = self._actions.keys()
-        self.mqtt.logger = self.logger
-        self.xbee.on_identification = self.xbee_on_identification
-        self.xbee.on_node_discovery = self.xbee_on_identification
-        self.xbee.on_message = self.xbee_on_message
-        self.xbee.logger = self.logger
+        if self.workers > 0:
+            # fork the workers before any thread or connection is started
+            self.shards = ShardPool(self.workers)
+            self.shards.logger = self.logger
+            self.shards.start(self.run_worker)
+        else:
+            self.setup()
 
-        self.mqtt.connect()
-        if not self.xbee.connect():
-            self.stop()
+        for radio in self.radios:
+            self.attach(radio)
+        for radio in self.radios:
+            if not radio.connect():
+                self.log(logging.ERROR, "Could not connect to radio at %s" % radio.serial.port)
+                self.stop()
 
         if self.discovery_on_connect:
             self.log(logging.INFO, "Requesting Node Discovery")
-            self.xbee.xbee.at(command='ND')
+            for radio in self.radios:
+                # every node answers with the same frame ID until NT expires
+                radio.at('ND', retries=0)
+
+        while self.shards:
+            try:
+                address, port, value, topic = self.shards.commands.get()
+            except (IOError, OSError):
+                # interrupted by a signal
+                continue
+            self.xbee_send_message(address, port, value, topic)
+
+        self.loop()
 
+    def loop(self):
+        """
+        Runs the MQTT network loop forever,
+        the MQTT client takes care of reconnecting when needed
+        """
         while True:
             try:
                 self.mqtt.loop()
+                if self.downsampler:
+                    self.downsampler.flush()
             except Exception as e:
                 logging.exception("Error while looping MQTT (%s)" % e)
 
+def radio_settings(config):
+    """
+    Returns the settings of every radio in the radios list,
+    every radio inherits the settings in the radio section it does not define
+    """
+    defaults = config.get('radio') or {}
+    return [dict(defaults, **settings) for settings in config.get('radios') or [{}]]
+
 if __name__ == "__main__":
 
     def resolve_path(path):
@@ -252,7 +600,8 @@ if __name__ == "__main__":
     logger.setLevel(config.get('daemon', 'logging_level', logging.INFO))
     logger.addHandler(handler)
 
-    mqtt = MosquittoWrapper(config.get('mqtt', 'client_id', None))
+    protocol = MQTTv5 if str(config.get('mqtt', 'protocol', '3.1.1')) == '5' else MQTTv311
+    mqtt = MosquittoWrapper(config.get('mqtt', 'client_id', None), protocol=protocol)
     mqtt.host = config.get('mqtt', 'host', 'localhost')
     mqtt.port = config.get('mqtt', 'port', 1883)
     mqtt.username = config.get('mqtt', 'username', None)
@@ -262,28 +611,73 @@ if __name__ == "__main__":
     mqtt.qos = config.get('mqtt', 'qos', 0)
     mqtt.retain = config.get('mqtt', 'retain', True)
     mqtt.set_will = config.get('mqtt', 'set_will', True)
-
-    try:
-        serial = Serial(
-            config.get('radio', 'port', '/dev/ttyUSB0'),
-            config.get('radio', 'baudrate', 9600)
-        )
-    except SerialException as e:
-        sys.exit(e)
-
-    xbee = XBeeWrapper()
-    xbee.serial = serial
-    xbee.default_port_name = config.get('radio', 'default_port_name', 'serial')
-    xbee.sample_rate = config.get('general', 'sample_rate', 0)
-    xbee.change_detection = config.get('general', 'change_detection', False)
-
-    processor = Processor(config.get('processor', 'filters', []))
+    mqtt.reconnect_min_delay = config.get('mqtt', 'reconnect_min_delay', 1)
+    mqtt.reconnect_max_delay = config.get('mqtt', 'reconnect_max_delay', 300)
+    mqtt.topic_alias_maximum = config.get('mqtt', 'topic_alias_maximum', 0)
+    mqtt.user_properties = config.get('mqtt', 'user_properties', True)
+
+    radios = []
+    for settings in radio_settings(config):
+        try:
+            serial = Serial(
+                settings.get('port', '/dev/ttyUSB0'),
+                settings.get('baudrate', 9600)
+            )
+        except SerialException as e:
+            sys.exit(e)
+
+        xbee = XBeeWrapper()
+        xbee.serial = serial
+        xbee.default_port_name = settings.get('default_port_name', 'serial')
+        xbee.escaped = settings.get('escaped', False)
+        xbee.native_decoder = settings.get('native_decoder', False)
+        xbee.lines.max_length = settings.get('line_max_length', 1024)
+        xbee.lines.timeout = settings.get('line_timeout', 30)
+        xbee.lines.flush = settings.get('line_flush', False)
+        xbee.sample_rate = config.get('general', 'sample_rate', 0)
+        xbee.change_detection = config.get('general', 'change_detection', False)
+        xbee.scheduler.window = settings.get('command_window', 8)
+        xbee.scheduler.node_window = settings.get('node_command_window', 1)
+        xbee.scheduler.timeout = settings.get('command_timeout', 5)
+        xbee.scheduler.retries = settings.get('command_retries', 2)
+        radios.append(xbee)
+
+    processor = Processor()
+    processor.logger = logger
+    if not processor.load(config.get('processor', 'filters', {})):
+        logger.error("%d invalid filter definitions found in %s" % (len(processor.errors), config_file))
+
+    downsampler = Downsampler()
+    downsampler.logger = logger
+    downsampler.configure(config.get('downsample'))
+
+    payloads = PayloadEncoder()
+    payloads.logger = logger
+    payloads.configure(config.get('payloads'))
+
+    queue = None
+    if config.get('queue', 'size', 1000) > 0:
+        queue = PublishQueue(mqtt, config.get('queue', 'size', 1000))
+        queue.inflight = config.get('queue', 'inflight', 100)
+        queue.configure(config.get('queue', 'events', []))
+        if config.get('journal', 'path', None):
+            journal = Journal(resolve_path(config.get('journal', 'path')))
+            journal.segment_size = config.get('journal', 'segment_size', journal.segment_size)
+            journal.max_size = config.get('journal', 'max_size', journal.max_size)
+            journal.max_age = config.get('journal', 'max_age', journal.max_age)
+            journal.rate = config.get('journal', 'rate', journal.rate)
+            journal.logger = logger
+            queue.journal = journal
 
     xbee2mqtt = Xbee2MQTT(resolve_path(config.get('daemon', 'pidfile', '/tmp/xbee2mqtt.pid')))
     xbee2mqtt.stdout = resolve_path(config.get('daemon', 'stdout', '/dev/null'))
     xbee2mqtt.stderr = resolve_path(config.get('daemon', 'stderr', xbee2mqtt.stdout))
     xbee2mqtt.discovery_on_connect = config.get('general', 'discovery_on_connect', True)
-    xbee2mqtt.duplicate_check_window = config.get('general', 'duplicate_check_window', 5)
+    xbee2mqtt.workers = config.get('general', 'workers', 0)
+    xbee2mqtt.duplicates = DuplicateStore(
+        config.get('general', 'duplicate_check_window', 5),
+        config.get('general', 'duplicate_check_size', 10000)
+    )
     xbee2mqtt.default_output_topic_pattern = config.get(
         'general', 'default_output_topic_pattern', '/raw/xbee/{address}/{port}'
     )
@@ -297,11 +691,16 @@ if __name__ == "__main__":
     xbee2mqtt.expose_undefined_topics = config.get(
         'general', 'expose_undefined_topics', xbee2mqtt.publish_undefined_topics
     )
+    xbee2mqtt.node_topic_pattern = config.get('general', 'node_topic_pattern', None)
+    xbee2mqtt.acknowledge_actions = config.get('general', 'acknowledge_actions', True)
     xbee2mqtt.load(config.get('general', 'routes', {}))
     xbee2mqtt.logger = logger
     xbee2mqtt.mqtt = mqtt
-    xbee2mqtt.xbee = xbee
+    xbee2mqtt.radios = radios
     xbee2mqtt.processor = processor
+    xbee2mqtt.downsampler = downsampler
+    xbee2mqtt.queue = queue
+    xbee2mqtt.payloads = payloads
     xbee2mqtt.config_file = config_file
 
     if len(sys.argv) == 2: